@@ -0,0 +1,143 @@
+"""
+Checkpoints of reading a .pgn file, so that reading a large file that was interrupted (by a crash, running out of
+memory or Ctrl-C) continues from where it stopped instead of starting over.
+
+Each file read gets its own folder in the checkpoint directory, holding:
+- state.json: the size and modification time of the file (a file that changed is read again from the start),
+  the byte offset reached in the (decompressed) file, the number of games read and of malformed games skipped,
+  the number of chunks saved, and whether the whole file was read
+- chunk-NNNNNN.pickle: the columns of the games read (see game_reader.HEADERS), a chunk per checkpoint
+
+Chunks are only ever added, and the state is replaced at once (written to a temporary file, then renamed), so a
+crash while saving a checkpoint leaves the previous one intact. Once the whole file was read, its checkpoint holds
+all of its games, so reading it again just loads them.
+"""
+from __future__ import annotations
+import hashlib
+import json
+import os
+import pickle
+from typing import Any, Optional
+
+# Save a checkpoint after reading this many games
+CHECKPOINT_EVERY = 10000
+STATE = "state.json"
+FORMAT_VERSION = 1
+
+
+class Checkpoint:
+    """
+    The last checkpoint of reading a .pgn file.
+    """
+    filename: str
+    offset: int
+    games: int
+    malformed: int
+    done: bool
+    # Private Instance Attributes:
+    # - _directory: The folder holding the checkpoint of the file
+    # - _signature: The size and modification time of the file
+    # - _chunks: The number of chunks of games saved
+    _directory: str
+    _signature: list[int]
+    _chunks: int
+
+    def __init__(self, checkpoint_dir: str, filename: str) -> None:
+        """
+        Load the last checkpoint of the file saved in checkpoint_dir. If there is none, or the file changed since,
+        the checkpoint is at the start of the file.
+        """
+        self.filename = filename
+        self._directory = os.path.join(checkpoint_dir, _folder_name(filename))
+        stat = os.stat(filename)
+        self._signature = [stat.st_size, stat.st_mtime_ns]
+        self.offset, self.games, self.malformed, self.done, self._chunks = 0, 0, 0, False, 0
+
+        state = _read_state(os.path.join(self._directory, STATE))
+        if state and state['version'] == FORMAT_VERSION and state['signature'] == self._signature:
+            self.offset, self.games, self.malformed = state['offset'], state['games'], state['malformed']
+            self.done, self._chunks = state['done'], state['chunks']
+
+    def load_games(self, data: dict[str, list]) -> None:
+        """Add the games saved so far to the columns of data."""
+        for chunk in range(self._chunks):
+            with open(self._chunk_path(chunk), 'rb') as f:
+                for header, column in pickle.load(f).items():
+                    data[header].extend(column)
+
+    def save(self, new_games: dict[str, list], offset: int, malformed: int, done: bool = False) -> None:
+        """
+        Save a checkpoint at the byte offset given, with the games read since the last checkpoint.
+        malformed is the number of malformed games skipped since the start of the file.
+
+        The checkpoint is only saved (on disk, and in this object) once the state is replaced. If saving is
+        interrupted before then, the last checkpoint is left as is, and a chunk written already is overwritten
+        by the next save.
+        """
+        os.makedirs(self._directory, exist_ok=True)
+        added = len(next(iter(new_games.values()), []))
+        chunks = self._chunks + 1 if added else self._chunks
+        if added:
+            _write_atomically(self._chunk_path(self._chunks), pickle.dumps(new_games, pickle.HIGHEST_PROTOCOL))
+
+        state = {
+            'version': FORMAT_VERSION,
+            'file': os.path.abspath(self.filename),
+            'signature': self._signature,
+            'offset': offset,
+            'games': self.games + added,
+            'malformed': malformed,
+            'chunks': chunks,
+            'done': done
+        }
+        _write_atomically(os.path.join(self._directory, STATE), json.dumps(state, indent=2).encode('utf-8'))
+        self.offset, self.games, self.malformed, self.done = offset, state['games'], malformed, done
+        self._chunks = chunks
+
+    def _chunk_path(self, chunk: int) -> str:
+        """Return the path of the given chunk of games."""
+        return os.path.join(self._directory, f"chunk-{chunk:06d}.pickle")
+
+
+def _folder_name(filename: str) -> str:
+    """
+    Return the name of the folder holding the checkpoint of the file, from its absolute path.
+
+    >>> _folder_name("/data/games.pgn") == _folder_name("/data/../data/games.pgn")
+    True
+    """
+    path = os.path.normpath(os.path.abspath(filename))
+    return hashlib.sha256(path.encode('utf-8')).hexdigest()[:16]
+
+
+def _read_state(path: str) -> Optional[dict[str, Any]]:
+    """Return the state saved at the path, or None if there is none."""
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _write_atomically(path: str, content: bytes) -> None:
+    """Write the content to the file at the path, only replacing the file there once fully written."""
+    temporary = path + ".tmp"
+    with open(temporary, 'wb') as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, path)
+
+
+if __name__ == '__main__':
+    pass
+    # import doctest
+    # doctest.testmod(verbose=True)
+    # import python_ta
+
+    # python_ta.check_all(config={
+    #     'max-line-length': 120,
+    #     'disable': ['E1136', 'W0221'],
+    #     'extra-imports': ['hashlib', 'json', 'os', 'pickle', 'Any', 'Optional'],
+    #     'max-nested-blocks': 4
+    # })
@@ -1,14 +1,20 @@
 """
 ChessData stores data for each chess game, including win rates, play rates, and play counts.
 
-The statistics are calculated for each time control and opening sequences.
+The statistics are calculated for each time control and opening sequences. When they are calculated from
+a sample of the games, they are approximate, and come with 95% confidence intervals.
 """
 from __future__ import annotations
+import copy
+import math
 from typing import Optional
 
-import pandas as pd
+from game_bitmap import GameBitmap, GameIndex
+from trends import TrendCounters
 
 PADDING = 12
+# z-score of a 95% confidence interval
+Z_95 = 1.96
 
 
 class ChessData:
@@ -20,41 +26,101 @@ class ChessData:
     playrate: dict[int, float]
     plays: dict[int, float]
     move_sequence: list[str]
+    games: GameBitmap
+    # Private Instance Attributes:
+    # - _index: The column bitmaps of the games database this data was calculated from
+    # - _parent_games: The games reaching the previous move sequence, used for the playrate
+    # - _prev_plays: The number of games reaching the previous move sequence, for each time control
+    # - _trends: The trends, or None if they have not been needed yet
+    _index: GameIndex
+    _parent_games: GameBitmap
+    _prev_plays: dict[int, int]
+    _trends: Optional[dict[int, TrendCounters]]
 
-    def __init__(self, move_sequence: list[str], data: pd.DataFrame, name: Optional[str] = None) -> None:
+    def __init__(self, move_sequence: list[str], data: GameIndex, name: Optional[str] = None,
+                 parent_games: Optional[GameBitmap] = None) -> None:
+        """
+        Calculate the data for the move sequence from the indexed games.
+
+        If parent_games (the games reaching move_sequence[:-1]) is given, it is used instead of
+        recomputing it from the index.
+        """
         self.name = name
         self.move_sequence = move_sequence
-        self._calc_data(move_sequence, data)
+        self._index = data
+        if parent_games is None:
+            parent_games = data.sequence(move_sequence[:-1])
+        self._parent_games = parent_games
+        self.games = parent_games & data.ply_move(len(move_sequence) - 1, move_sequence[-1]) \
+            if move_sequence else parent_games
+        self._calc_data(self.games, self._parent_games)
 
-    def _calc_data(self, move_sequence: list[str], data: pd.DataFrame) -> None:
+    def _calc_data(self, games: GameBitmap, parent_games: GameBitmap) -> None:
         """Calculate the win rate if this move is played for different time controls."""
         win_data = {}
         playrate = {}
         plays = {}
-        tcs = data['time_control'].unique()
+        prev_plays = {}
 
-        for tc in tcs:
+        for tc in self._index.values('time_control'):
             # Filter by time control first
-            filtered_curr = data[(data['time_control'] == tc)
-                                 & (data['moves'].apply(lambda moves: isinstance(moves, list) and moves[:len(
-                                     move_sequence)] == move_sequence))]
+            tc_games = self._index.column('time_control', tc)
+            filtered_curr = games & tc_games
 
             plays[tc] = len(filtered_curr)
             win_data[tc] = {}
             for winner in ["white", "black", "draw"]:
                 # Avoid NaN values
-                win_data[tc][winner] = len(filtered_curr[filtered_curr['winner'] == winner]) / len(filtered_curr) \
-                    if not filtered_curr.empty else 0.0
-            # Previous move sequence filtering
-            filtered_prev = data[(data['time_control'] == tc)
-                                 & (data['moves'].apply(lambda moves: isinstance(moves, list) and moves[:max(len(
-                                     move_sequence) - 1, 0)] == move_sequence[:-1]))]
+                win_data[tc][winner] = len(filtered_curr & self._index.column('winner', winner)) / plays[tc] \
+                    if plays[tc] else 0.0
             # Avoid division by zero
-            playrate[tc] = len(filtered_curr) / len(filtered_prev) if len(filtered_prev) > 0 else 0.0
+            prev_plays[tc] = len(parent_games & tc_games)
+            playrate[tc] = plays[tc] / prev_plays[tc] if prev_plays[tc] > 0 else 0.0
 
         self.win_data = win_data
         self.playrate = playrate
         self.plays = plays
+        self._prev_plays = prev_plays
+        self._trends = None
+
+    @property
+    def trends(self) -> dict[int, TrendCounters]:
+        """
+        The games of each time control by the day they were played on. Time controls without dated games are left out.
+
+        They are counted from the games of each day kept by the index (see GameIndex.trends) when first needed
+        (by the trend command), rather than for every node built or filtered, and kept afterwards.
+        """
+        if self._trends is None:
+            self._trends = self._index.trends(self.games)
+        return self._trends
+
+    def rebind(self, data: GameIndex, parent_games: Optional[GameBitmap] = None) -> None:
+        """
+        Use the given index from now on, which must contain at least the games of the current one (like the
+        index of the whole database, for data calculated from a part of it).
+
+        If parent_games is given, they replace the games reaching the previous move sequence, and the
+        playrate is calculated again.
+        """
+        self._index = data
+        if parent_games is None:
+            return
+
+        self._parent_games = parent_games
+        for tc in self.plays:
+            self._prev_plays[tc] = len(parent_games & data.column('time_control', tc))
+            self.playrate[tc] = self.plays[tc] / self._prev_plays[tc] if self._prev_plays[tc] > 0 else 0.0
+
+    def filtered(self, games_filter: GameBitmap) -> ChessData:
+        """
+        Return a copy of this data, with the statistics calculated only from the games in the filter.
+        """
+        view = copy.copy(self)
+        view.games = self.games & games_filter
+        view._parent_games = self._parent_games & games_filter
+        view._calc_data(view.games, view._parent_games)
+        return view
 
     def output_stats(self, tc: int) -> None:
         """Print out the stats for this board state, given the time control."""
@@ -65,15 +131,69 @@ class ChessData:
             print(f"<NO DATA FOR TC {tc} SECONDS>")
             return
 
-        print(f"{'GAME RESULT':>{PADDING}}{'PERCENT':>{PADDING}}")
+        approximate = self.is_approximate()
+        print(f"{'GAME RESULT':>{PADDING}}{'PERCENT':>{PADDING}}" + (f"{'95% INTERVAL':>{PADDING * 2}}"
+                                                                      if approximate else ""))
 
         win_dat = self.win_data[tc]
         for winner in win_dat:
-            print(f"{winner:>{PADDING}}{f"{percentify(win_dat[winner], 2)}":>{PADDING}}")
+            print(f"{winner:>{PADDING}}{f"{percentify(win_dat[winner], 2)}":>{PADDING}}"
+                  + (f"{format_interval(self.get_interval(winner, tc), 2):>{PADDING * 2}}" if approximate else ""))
 
-        print(f"PLAYS: {self.plays[tc]}")
+        if approximate:
+            print(f"PLAYS: ~{round(self.get_plays(tc))} (estimated from {self.plays[tc]} sampled games)")
+        else:
+            print(f"PLAYS: {self.plays[tc]}")
         if self.move_sequence:  # special case. It doesn't make sense to have a previous move.
-            print(f"Players played this {percentify(self.playrate[tc], 2)} of the time after the previous move.")
+            print(f"Players played this {percentify(self.playrate[tc], 2)} of the time after the previous move."
+                  + (f" 95% interval: {format_interval(self.get_interval('playrate', tc), 2)}" if approximate else ""))
+
+    def is_approximate(self) -> bool:
+        """Return whether this data was calculated from a sample of the games."""
+        return self._index.population is not None
+
+    def get_plays(self, tc: Optional[int]) -> float:
+        """
+        Return the number of games that reached this sequence for the given timecontrol. If the data is
+        approximate, this is estimated for the whole dataset from the sample. Return 0.0 if no data.
+        """
+        plays = self.plays.get(tc, 0)
+        if not self.is_approximate():
+            return plays
+        sampled = len(self._index.column('time_control', tc))
+        return plays * self._index.population.get(tc, 0) / sampled if sampled else 0.0
+
+    def get_interval(self, stat: str, tc: Optional[int]) -> tuple[float, float]:
+        """
+        Return the 95% confidence interval of the win rate of stat for the given timecontrol, or of the playrate
+        if stat is 'playrate'. If the data is exact, both ends of the interval are the value itself.
+
+        Preconditions:
+        - stat in {'black', 'white', 'draw', 'playrate'}
+        """
+        value = self.get_playrate(tc) if stat == 'playrate' else self.get_winrate(stat, tc)
+        if not self.is_approximate():
+            return value, value
+        return confidence_interval(*self.get_counts(stat, tc))
+
+    def get_counts(self, stat: str, tc: Optional[int]) -> tuple[int, int]:
+        """
+        Return the win rate of stat (or the playrate, if stat is 'playrate') for the given timecontrol as
+        (number of successes, number of games). If tc is None, the counts of every timecontrol are added up.
+
+        Preconditions:
+        - stat in {'black', 'white', 'draw', 'playrate'}
+        """
+        successes, samples = 0, 0
+        for count_tc in (self.plays if tc is None else [tc]):
+            plays = self.plays.get(count_tc, 0)
+            if stat == 'playrate':
+                successes += plays
+                samples += self._prev_plays.get(count_tc, 0)
+            else:
+                successes += round(self.get_winrate(stat, count_tc) * plays)
+                samples += plays
+        return successes, samples
 
     def get_name(self) -> str:
         """
@@ -116,6 +236,57 @@ def percentify(val: float, dp: int) -> str:
     return f"{round(val * 100, dp)}%"
 
 
+def confidence_interval(successes: int, samples: int, z: float = Z_95) -> tuple[float, float]:
+    """
+    Return the Wilson score interval of the proportion of successes out of the samples.
+    With no samples, nothing is known, so return (0.0, 1.0).
+
+    >>> tuple(round(x, 4) for x in confidence_interval(50, 100))
+    (0.4038, 0.5962)
+    >>> confidence_interval(0, 0)
+    (0.0, 1.0)
+    """
+    if samples == 0:
+        return 0.0, 1.0
+
+    p = successes / samples
+    denominator = 1 + z ** 2 / samples
+    centre = (p + z ** 2 / (2 * samples)) / denominator
+    margin = z * math.sqrt(p * (1 - p) / samples + z ** 2 / (4 * samples ** 2)) / denominator
+    return max(0.0, centre - margin), min(1.0, centre + margin)
+
+
+def two_proportion_test(successes_a: int, samples_a: int, successes_b: int, samples_b: int) -> float:
+    """
+    Return the p-value of a two-sided two proportion z-test, of whether the proportions of successes
+    out of the samples of a and b differ. Return 1.0 if there is nothing to compare.
+
+    >>> round(two_proportion_test(60, 100, 40, 100), 4)
+    0.0047
+    >>> two_proportion_test(0, 0, 5, 10)
+    1.0
+    """
+    if samples_a == 0 or samples_b == 0:
+        return 1.0
+
+    pooled = (successes_a + successes_b) / (samples_a + samples_b)
+    error = math.sqrt(pooled * (1 - pooled) * (1 / samples_a + 1 / samples_b))
+    if error == 0:
+        return 1.0
+    z = (successes_a / samples_a - successes_b / samples_b) / error
+    return math.erfc(abs(z) / math.sqrt(2))
+
+
+def format_interval(interval: tuple[float, float], dp: int) -> str:
+    """
+    Return the interval as a string of percentages, rounded to dp decimal points.
+
+    >>> format_interval((0.4038, 0.5962), 1)
+    '[40.4%, 59.6%]'
+    """
+    return f"[{percentify(interval[0], dp)}, {percentify(interval[1], dp)}]"
+
+
 if __name__ == '__main__':
     pass
     # import doctest
@@ -125,7 +296,8 @@ if __name__ == '__main__':
     # python_ta.check_all(config={
     #     'max-line-length': 120,
     #     'disable': ['E1136', 'W0221'],
-    #     'extra-imports': ['move_tree', 'percentify', 'Optional', 'chess_data', 'pandas'],
+    #     'extra-imports': ['move_tree', 'percentify', 'Optional', 'chess_data', 'copy', 'game_bitmap',
+    #                       'math', 'trends'],
     #     'allowed-io': ['ChessData.output_stats'],
     #     'max-nested-blocks': 4
     # })
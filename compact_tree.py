@@ -0,0 +1,354 @@
+"""
+A compact, array-backed MoveTree.
+
+Every node of a MoveTree is a Python object with a list of next moves and a ChessData holding dicts of
+statistics (and the bitmaps of its games), which costs a lot of memory per node. A TreeArrays stores
+the same tree as a structure of arrays instead: the parent, first next move and next sibling of each node,
+its move and opening name (as IDs into tables of the distinct moves and names), and its counts for every
+time control, all in contiguous typed arrays. Nodes are numbered breadth first, so the next moves of a node
+are next to each other.
+
+CompactTree and CompactData are light views of one node of a TreeArrays, with the same interface as MoveTree
+and ChessData (so the Traverser can use them as is). They are read-only, and created on demand. CountsData is
+the part of CompactData reading the statistics from counts, for other trees storing counts (see tree_export).
+"""
+from __future__ import annotations
+from abc import ABC, abstractmethod
+from array import array
+from collections import deque
+from typing import Any, Optional
+
+from chess_data import ChessData
+from game_bitmap import GameBitmap, GameIndex
+from move_tree import MoveTree, build_tree
+from trends import TrendCounters
+
+# The counts stored for each node and time control, in order
+COUNTERS = ['plays', 'prev_plays', 'white', 'black', 'draw']
+# The ID of a missing node or opening name
+NONE = -1
+_OFFSETS = {counter: offset for offset, counter in enumerate(COUNTERS)}
+
+
+class TreeArrays:
+    """
+    The nodes of a MoveTree, and their statistics, stored in arrays. Node 0 is the root.
+    """
+    time_controls: list[int]
+    moves: list[str]
+    names: list[str]
+    index: Optional[GameIndex]
+    # Private Instance Attributes:
+    # - _parent, _first_child, _next_sibling: The parent, first next move and next sibling of each node
+    #                                         (NONE if there is none)
+    # - _move: The ID of the move of each node (in moves)
+    # - _name: The ID of the opening name of each node (in names), or NONE
+    # - _counts: The COUNTERS of each node, for each time control in time_controls, one after the other
+    # - _offsets: Maps each time control to where its counts start, among the counts of a node
+    # - _trends: The trends of the nodes they were needed for so far (see GameIndex.trends), by node
+    _parent: array
+    _first_child: array
+    _next_sibling: array
+    _move: array
+    _name: array
+    _counts: array
+    _offsets: dict[int, int]
+    _trends: dict[int, dict[int, TrendCounters]]
+
+    def __init__(self, tree: MoveTree, index: Optional[GameIndex] = None) -> None:
+        """
+        Store the given tree. If given, the index of the games the tree was built from is kept, so that
+        the statistics can be filtered, and trends calculated, like for the tree itself.
+
+        Preconditions:
+        - every node of the tree has data
+        """
+        self.index = index
+        self._trends = {}
+        self.time_controls = list(tree.data.plays)
+        self._offsets = {tc: column * len(COUNTERS) for column, tc in enumerate(self.time_controls)}
+        self.moves, self.names = [], []
+        move_ids, name_ids = {}, {}
+        self._parent, self._first_child, self._next_sibling = array('i'), array('i'), array('i')
+        self._move, self._name, self._counts = array('i'), array('i'), array('I')
+
+        queue = deque([(tree, NONE)])
+        while queue:
+            node, parent = queue.popleft()
+            node_id = len(self._parent)
+            self._parent.append(parent)
+            self._first_child.append(node_id + len(queue) + 1 if node.next_moves else NONE)
+            self._next_sibling.append(NONE)
+            if parent != NONE and self._first_child[parent] != node_id:
+                self._next_sibling[node_id - 1] = node_id
+            self._move.append(_intern(node.move, self.moves, move_ids))
+            self._name.append(_intern(node.data.name, self.names, name_ids) if node.data.name else NONE)
+            for tc in self.time_controls:
+                self._counts.extend(node_counts(node.data, tc))
+            queue.extend((next_move, node_id) for next_move in node.next_moves)
+
+    def __len__(self) -> int:
+        """Return the number of nodes."""
+        return len(self._parent)
+
+    def root(self) -> CompactTree:
+        """Return the view of the root of the tree."""
+        return CompactTree(self, 0)
+
+    def parent(self, node: int) -> int:
+        """Return the parent of the node, or NONE if it is the root."""
+        return self._parent[node]
+
+    def children(self, node: int) -> list[int]:
+        """Return the next moves of the node, in order."""
+        children = []
+        child = self._first_child[node]
+        while child != NONE:
+            children.append(child)
+            child = self._next_sibling[child]
+        return children
+
+    def move(self, node: int) -> str:
+        """Return the move of the node."""
+        return self.moves[self._move[node]]
+
+    def name(self, node: int) -> Optional[str]:
+        """Return the opening name of the node, or None if it is not an opening."""
+        name_id = self._name[node]
+        return None if name_id == NONE else self.names[name_id]
+
+    def count(self, node: int, tc: Optional[int], counter: str) -> int:
+        """
+        Return the count of the node for the time control, or 0 if there are no games of that time control.
+
+        Preconditions:
+        - counter in COUNTERS
+        """
+        offset = self._offsets.get(tc)
+        if offset is None:
+            return 0
+        return self._counts[node * len(self._offsets) * len(COUNTERS) + offset + _OFFSETS[counter]]
+
+    def trends(self, node: int) -> dict[int, TrendCounters]:
+        """
+        Return the trends of the node (see GameIndex.trends), or no trends if the index was not kept.
+        They are only calculated the first time they are needed for the node.
+        """
+        if self.index is None:
+            return {}
+        if node not in self._trends:
+            self._trends[node] = self.index.trends(self.index.sequence(CompactTree(self, node).get_path()))
+        return self._trends[node]
+
+    def memory_used(self) -> int:
+        """Return the memory used by the arrays, in bytes (not counting the move and name tables or the index)."""
+        arrays = [self._parent, self._first_child, self._next_sibling, self._move, self._name, self._counts]
+        return sum(len(values) * values.itemsize for values in arrays)
+
+
+class CompactTree(MoveTree):
+    """
+    A view of one node of a TreeArrays, which can be used like a MoveTree but cannot be changed.
+    """
+    # Private Instance Attributes:
+    # - _arrays: The tree this is a node of
+    # - _node: The number of the node in _arrays
+    _arrays: TreeArrays
+    _node: int
+
+    def __init__(self, arrays: TreeArrays, node: int) -> None:  # pylint: disable=super-init-not-called
+        self._arrays = arrays
+        self._node = node
+
+    @property
+    def move(self) -> str:
+        return self._arrays.move(self._node)
+
+    @property
+    def parent(self) -> Optional[CompactTree]:
+        parent = self._arrays.parent(self._node)
+        return None if parent == NONE else CompactTree(self._arrays, parent)
+
+    @property
+    def next_moves(self) -> list[CompactTree]:
+        return [CompactTree(self._arrays, child) for child in self._arrays.children(self._node)]
+
+    @property
+    def data(self) -> CompactData:
+        return CompactData(self)
+
+    def insert_sequence(self, move_sequence: list[str], games_database: Optional[GameIndex] = None,
+                        openings_database: Optional[dict[tuple[str, ...], str]] = None) -> None:
+        raise TypeError("A CompactTree cannot be changed")
+
+    def __eq__(self, other: Any) -> bool:
+        return isinstance(other, CompactTree) and self._arrays is other._arrays and self._node == other._node
+
+    def __hash__(self) -> int:
+        return hash((id(self._arrays), self._node))
+
+
+class CountsData(ChessData, ABC):
+    """
+    Statistics read from stored counts (see COUNTERS) instead of calculated from the games, which can be used
+    like a ChessData. Subclasses give the time controls and the counts of each.
+    """
+
+    @abstractmethod
+    def _time_controls(self) -> list[int]:
+        """Return the time controls counts are stored for."""
+
+    @abstractmethod
+    def _count(self, tc: Optional[int], counter: str) -> int:
+        """
+        Return the stored count for the time control, or 0 if there are no games of that time control.
+
+        Preconditions:
+        - counter in COUNTERS
+        """
+
+    @property
+    def plays(self) -> dict[int, int]:
+        return {tc: self._count(tc, 'plays') for tc in self._time_controls()}
+
+    @property
+    def win_data(self) -> dict[int, dict[str, float]]:
+        return {tc: {winner: self.get_winrate(winner, tc) for winner in ['white', 'black', 'draw']}
+                for tc in self._time_controls()}
+
+    @property
+    def playrate(self) -> dict[int, float]:
+        return {tc: self.get_playrate(tc) for tc in self._time_controls()}
+
+    @property
+    def _prev_plays(self) -> dict[int, int]:
+        return {tc: self._count(tc, 'prev_plays') for tc in self._time_controls()}
+
+    def get_playrate(self, tc: Optional[int]) -> float:
+        prev_plays = self._count(tc, 'prev_plays')
+        return self._count(tc, 'plays') / prev_plays if prev_plays else 0.0
+
+    def get_winrate(self, winner: str, tc: int) -> float:
+        plays = self._count(tc, 'plays')
+        return self._count(tc, winner) / plays if plays else 0.0
+
+
+class CompactData(CountsData):
+    """
+    The statistics of one node of a TreeArrays, which can be used like a ChessData.
+
+    Filtering the statistics and calculating trends need the games, so they are only possible if the
+    TreeArrays kept the index of the games. The data is then calculated again from the games when needed.
+    """
+    # Private Instance Attributes:
+    # - _tree: The node this is the data of
+    _tree: CompactTree
+
+    def __init__(self, tree: CompactTree) -> None:  # pylint: disable=super-init-not-called
+        self._tree = tree
+
+    @property
+    def name(self) -> Optional[str]:
+        return self._tree._arrays.name(self._tree._node)
+
+    @property
+    def move_sequence(self) -> list[str]:
+        return self._tree.get_path()
+
+    @property
+    def _index(self) -> Optional[GameIndex]:
+        return self._tree._arrays.index
+
+    @property
+    def games(self) -> GameBitmap:
+        return self._full().games
+
+    @property
+    def trends(self) -> dict[int, TrendCounters]:
+        return self._tree._arrays.trends(self._tree._node)
+
+    def is_approximate(self) -> bool:
+        return self._index is not None and self._index.population is not None
+
+    def filtered(self, games_filter: GameBitmap) -> ChessData:
+        """
+        Return the data with the statistics calculated only from the games in the filter.
+
+        Preconditions:
+        - self._index is not None
+        """
+        return self._full().filtered(games_filter)
+
+    def _time_controls(self) -> list[int]:
+        return self._tree._arrays.time_controls
+
+    def _count(self, tc: Optional[int], counter: str) -> int:
+        return self._tree._arrays.count(self._tree._node, tc, counter)
+
+    def _full(self) -> ChessData:
+        """
+        Return the data of this node calculated again from the games.
+
+        Preconditions:
+        - self._index is not None
+        """
+        return ChessData(self.move_sequence, self._index, self.name)
+
+
+def build_compact_tree(games_database: GameIndex, openings_database: dict[tuple[str, ...], str],
+                       keep_index: bool = True) -> CompactTree:
+    """
+    Return a compact MoveTree of all the openings given, with the data of each node calculated from the
+    indexed games. The index is kept (for filtering and trends) if keep_index is True.
+
+    The tree is first built as a MoveTree, so building takes as much memory as build_tree; only the
+    compact tree is kept afterwards. Its statistics are exactly those of the MoveTree:
+    >>> games = GameIndex({'moves': [['e4', 'e5'], ['d4', 'd5'], ['e4', 'c5'], ['e4', 'e5'], ['d4']],
+    ...                    'time_control': [60, 180, 60, 180, 60],
+    ...                    'winner': ['white', 'draw', 'black', 'white', 'black']})
+    >>> openings = {('e4', 'e5'): "Open Game", ('d4',): "Queen's Pawn Game", ('e4', 'c5'): "Sicilian Defense",
+    ...             ('d4', 'd5'): "Closed Game"}
+    >>> tree, compact = build_tree(games, openings), build_compact_tree(games, openings)
+    >>> compact.same_as(tree)
+    True
+    >>> white_won = games.column('winner', 'white')
+    >>> compact.next_moves[0].data.filtered(white_won).plays == tree.next_moves[0].data.filtered(white_won).plays
+    True
+    """
+    return TreeArrays(build_tree(games_database, openings_database), games_database if keep_index else None).root()
+
+
+def node_counts(data: ChessData, tc: int) -> list[int]:
+    """Return the COUNTERS of the data for the time control."""
+    plays = data.plays.get(tc, 0)
+    return [plays, data.get_counts('playrate', tc)[1]] + [round(data.get_winrate(winner, tc) * plays)
+                                                         for winner in ['white', 'black', 'draw']]
+
+
+def _intern(value: str, table: list[str], ids: dict[str, int]) -> int:
+    """
+    Return the ID of the value in the table, adding it to the table if it is not in it yet.
+
+    >>> table, ids = [], {}
+    >>> [_intern(move, table, ids) for move in ['e4', 'd4', 'e4']]
+    [0, 1, 0]
+    """
+    if value not in ids:
+        ids[value] = len(table)
+        table.append(value)
+    return ids[value]
+
+
+if __name__ == '__main__':
+    pass
+    # import doctest
+    # doctest.testmod(verbose=True)
+    # import python_ta
+
+    # python_ta.check_all(config={
+    #     'max-line-length': 120,
+    #     'disable': ['E1136', 'W0221'],
+    #     'extra-imports': ['abc', 'array', 'collections', 'Any', 'Optional', 'chess_data', 'game_bitmap', 'move_tree',
+    #                       'trends'],
+    #     'max-nested-blocks': 4
+    # })
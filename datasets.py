@@ -0,0 +1,162 @@
+"""
+The datasets of games that can be explored, and loading them into a MoveTree.
+
+Datasets share many files, so the games parsed from each file are cached and reused when
+switching between datasets.
+"""
+from __future__ import annotations
+from typing import Optional
+
+from game_reader import HEADERS, GameCache, read_games, read_games_sample
+from game_bitmap import GameBitmap, GameIndex
+from move_tree import MoveTree, build_tree
+from sharded_build import build_tree_sharded
+from compact_tree import TreeArrays
+
+ALL_GAMES = [
+    "data/games/lichess_tournament_2025.03.26_G0j0ZKLB_2000-superblitz (1).pgn",
+    "data/games/lichess_tournament_2025.03.28_bHUDi9Ci_daily-rapid.pgn",
+    "data/games/lichess_tournament_2025.03.24_aByKLmHE_daily-superblitz.pgn",
+    "data/games/lichess_tournament_2025.03.25_45UeSiXu_daily-blitz.pgn",
+    "data/games/lichess_tournament_2025.03.25_OvDcYlTU_daily-rapid.pgn",
+    "data/games/lichess_tournament_2025.03.25_tqzGNmOv_daily-bullet.pgn"
+]
+
+BLITZ_ONLY = [
+    "data/games/lichess_tournament_2025.03.25_45UeSiXu_daily-blitz.pgn",
+    "data/games/lichess_tournament_2025.03.24_aByKLmHE_daily-superblitz.pgn"
+]
+
+BULLET_ONLY = [
+    "data/games/lichess_tournament_2025.03.25_tqzGNmOv_daily-bullet.pgn"
+]
+
+RAPID_ONLY = [
+    "data/games/lichess_tournament_2025.03.28_bHUDi9Ci_daily-rapid.pgn",
+    "data/games/lichess_tournament_2025.03.25_OvDcYlTU_daily-rapid.pgn"
+]
+
+# Maps the name of each dataset to its files and its default time control
+DATASETS = {
+    'all': (ALL_GAMES, 180),
+    'blitz': (BLITZ_ONLY, 180),
+    'bullet': (BULLET_ONLY, 60),
+    'rapid': (RAPID_ONLY, 600)
+}
+
+# Default memory limit of the parsed games cache, in bytes
+CACHE_LIMIT = 1024 * 1024 * 1024
+
+
+class DatasetLoader:
+    """
+    Builds the MoveTree for a dataset, reusing the games parsed for previous datasets.
+    """
+    openings_database: dict[tuple[str, ...], str]
+    max_moves: int
+    cache: GameCache
+    shard_depth: Optional[int]
+    processes: Optional[int]
+    sample_rate: Optional[float]
+    compact: bool
+
+    def __init__(self, openings_database: dict[tuple[str, ...], str], max_moves: int,
+                 cache_limit: Optional[int] = CACHE_LIMIT, shard_depth: Optional[int] = None,
+                 processes: Optional[int] = None, sample_rate: Optional[float] = None,
+                 compact: bool = False, checkpoint_dir: Optional[str] = None) -> None:
+        """
+        Create a loader building trees of the given openings, limited to max_moves moves.
+        The parsed games cache uses at most (roughly) cache_limit bytes, or has no limit if None.
+
+        If shard_depth is given, trees are built in parallel by the given number of processes (by default,
+        one per core), with the games split by their first shard_depth moves (see sharded_build).
+
+        If sample_rate is given, trees are built with approximate data from that fraction of the games of
+        each time control (see game_reader.read_games_sample).
+
+        If compact is True, the trees loaded are stored as arrays (see compact_tree), which takes much less
+        memory once built.
+
+        If checkpoint_dir is given, reading each file saves checkpoints there, so that reading a file that was
+        interrupted continues from where it stopped (see game_reader.GameCache).
+        """
+        self.openings_database = openings_database
+        self.max_moves = max_moves
+        self.cache = GameCache(cache_limit, checkpoint_dir)
+        self.shard_depth = shard_depth
+        self.processes = processes
+        self.sample_rate = sample_rate
+        self.compact = compact
+
+    def load(self, name: str) -> tuple[MoveTree, GameIndex, int]:
+        """
+        Return the MoveTree built from the dataset, the index of its games and its default time control.
+
+        Preconditions:
+        - name in DATASETS
+        """
+        files, tc = DATASETS[name]
+        if self.sample_rate:
+            tree, games_database = self.build(*read_games_sample(files, self.sample_rate, cache=self.cache))
+        else:
+            tree, games_database = self.build(read_games(files, self.cache))
+        if self.compact:
+            tree = TreeArrays(tree, games_database).root()
+        return tree, games_database, tc
+
+    def load_comparison(self, names: list[str]) -> tuple[MoveTree, GameIndex, dict[str, GameBitmap]]:
+        """
+        Return a single MoveTree built from the games of all the datasets at once, the index of the games, and
+        the games of each dataset. Games in files shared between datasets are only counted once.
+
+        Preconditions:
+        - all(name in DATASETS for name in names)
+        """
+        files = list(dict.fromkeys(filename for name in names for filename in DATASETS[name][0]))
+        games = {header: [] for header in HEADERS}
+        file_ids = {}
+        for filename in files:
+            file_games = self.cache.get(filename)
+            start = len(games['moves'])
+            for header in HEADERS:
+                games[header].extend(file_games[header])
+            file_ids[filename] = range(start, len(games['moves']))
+
+        tree, games_database = self.build(games)
+        if self.compact:
+            tree = TreeArrays(tree, games_database).root()
+        dataset_games = {name: GameBitmap(game_id for filename in DATASETS[name][0] for game_id in file_ids[filename])
+                         for name in names}
+        return tree, games_database, dataset_games
+
+    def build(self, games: dict[str, list],
+              population: Optional[dict[int, int]] = None) -> tuple[MoveTree, GameIndex]:
+        """
+        Return the MoveTree built from the games (as columns, like from game_reader.read_games),
+        and the index of the games.
+
+        If the games are a sample, population maps each time control to its number of games in the whole
+        dataset, and the data of the tree is approximate.
+        """
+        if self.shard_depth:
+            tree, games_database = build_tree_sharded(games, self.openings_database, self.max_moves,
+                                                      self.shard_depth, self.processes)
+        else:
+            games_database = GameIndex(games, self.max_moves)
+            tree = build_tree(games_database, self.openings_database)
+        games_database.population = population
+        return tree, games_database
+
+
+if __name__ == '__main__':
+    pass
+    # import doctest
+    # doctest.testmod(verbose=True)
+    # import python_ta
+
+    # python_ta.check_all(config={
+    #     'max-line-length': 120,
+    #     'disable': ['E1136', 'W0221'],
+    #     'extra-imports': ['game_reader', 'game_bitmap', 'move_tree', 'sharded_build', 'compact_tree', 'Optional'],
+    #     'max-nested-blocks': 4
+    # })
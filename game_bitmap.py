@@ -0,0 +1,535 @@
+"""
+Compressed bitmaps of game IDs, and the per-column bitmaps used to filter games.
+
+Every game that is read in is given an ID (its row in the games database). A GameBitmap stores a set
+of these IDs in a roaring-style layout: IDs are split into chunks of 2^16 by their high bits, and each
+chunk is stored as either a sorted array (when sparse) or a bitset (when dense). Counting the games
+that satisfy several conditions is then just intersecting bitmaps and counting the result.
+"""
+from __future__ import annotations
+from array import array
+from typing import Any, Iterable, Iterator, Optional, Union
+
+from trends import COUNTS, NO_DAY, TrendCounters, day_number
+
+CHUNK_BITS = 16
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+# A chunk with more IDs than this is stored as a bitset instead of an array
+ARRAY_LIMIT = 4096
+# A chunk with more IDs than this is stored as a bitset by GameBitmap.dense
+DENSE_LIMIT = 256
+
+# The columns of the games database that can be filtered on
+FILTER_COLUMNS = ['elo_white', 'elo_black', 'white', 'black', 'opening', 'time_control', 'winner', 'termination']
+# Supported comparison operators. Longer operators first so that '>=' is not parsed as '>'
+OPERATORS = ['!=', '>=', '<=', '=', '>', '<']
+
+Container = Union[array, int]
+
+
+class GameBitmap:
+    """
+    An immutable, compressed set of game IDs.
+    """
+    # Private Instance Attributes:
+    # - _containers: Maps the high bits of an ID to the chunk holding the low bits of all IDs sharing them.
+    #                A chunk is either a sorted array('H') or an int used as a bitset. Empty chunks are never stored.
+    _containers: dict[int, Container]
+
+    def __init__(self, ids: Iterable[int] = ()) -> None:
+        """
+        Create a bitmap holding the given game IDs.
+
+        >>> len(GameBitmap([3, 1, 70000, 3]))
+        3
+        """
+        chunks = {}
+        for game_id in ids:
+            chunks.setdefault(game_id >> CHUNK_BITS, set()).add(game_id & CHUNK_MASK)
+
+        self._containers = {}
+        for key in sorted(chunks):
+            self._containers[key] = _make_container(sorted(chunks[key]))
+
+    @classmethod
+    def _from_containers(cls, containers: dict[int, Container]) -> GameBitmap:
+        """Return a bitmap using the given containers as is."""
+        bitmap = cls.__new__(cls)
+        bitmap._containers = containers
+        return bitmap
+
+    @classmethod
+    def full(cls, size: int) -> GameBitmap:
+        """
+        Return a bitmap of all game IDs in range(size).
+
+        >>> list(GameBitmap.full(3))
+        [0, 1, 2]
+        """
+        containers = {}
+        for key in range((size + CHUNK_MASK) >> CHUNK_BITS):
+            chunk_size = min(size - (key << CHUNK_BITS), 1 << CHUNK_BITS)
+            containers[key] = (1 << chunk_size) - 1 if chunk_size > ARRAY_LIMIT else array('H', range(chunk_size))
+        return cls._from_containers(containers)
+
+    def __len__(self) -> int:
+        """Return the number of games in this bitmap."""
+        return sum(len(c) if isinstance(c, array) else c.bit_count() for c in self._containers.values())
+
+    def __bool__(self) -> bool:
+        return bool(self._containers)
+
+    def __iter__(self) -> Iterator[int]:
+        """Iterate over the game IDs in increasing order."""
+        for key, container in self._containers.items():
+            base = key << CHUNK_BITS
+            for low in _container_values(container):
+                yield base | low
+
+    def first(self) -> Optional[int]:
+        """
+        Return the smallest game ID, or None if the bitmap is empty.
+
+        >>> GameBitmap([70001, 70000]).first(), GameBitmap.full(5000).first(), GameBitmap().first()
+        (70000, 0, None)
+        """
+        for key, container in self._containers.items():
+            low = container[0] if isinstance(container, array) else (container & -container).bit_length() - 1
+            return key << CHUNK_BITS | low
+        return None
+
+    def __contains__(self, game_id: int) -> bool:
+        container = self._containers.get(game_id >> CHUNK_BITS)
+        if container is None:
+            return False
+        low = game_id & CHUNK_MASK
+        if isinstance(container, int):
+            return bool(container >> low & 1)
+        return low in container
+
+    def __eq__(self, other: Any) -> bool:
+        return isinstance(other, GameBitmap) and list(self) == list(other)
+
+    def __and__(self, other: GameBitmap) -> GameBitmap:
+        """
+        Return the games that are in both bitmaps.
+
+        >>> list(GameBitmap([1, 2, 3, 70000]) & GameBitmap([2, 3, 4, 70000]))
+        [2, 3, 70000]
+        """
+        containers = {}
+        small, large = (self, other) if len(self._containers) <= len(other._containers) else (other, self)
+        for key, container in small._containers.items():
+            other_container = large._containers.get(key)
+            if other_container is None:
+                continue
+            result = _and_containers(container, other_container)
+            if result:
+                containers[key] = result
+        return GameBitmap._from_containers(containers)
+
+    def dense(self, limit: int = DENSE_LIMIT) -> GameBitmap:
+        """
+        Return the same games, with every chunk of more than limit IDs stored as a bitset. Counting the games
+        it has in common with a dense bitmap (see intersection_len) is then a single operation on their bitsets,
+        at the cost of some memory.
+
+        >>> bitmap = GameBitmap(range(0, 2000, 2)).dense()
+        >>> len(bitmap), bitmap.intersection_len(GameBitmap.full(1000))
+        (1000, 500)
+        """
+        return GameBitmap._from_containers({key: _to_bits(container) if isinstance(container, int)
+                                            or len(container) > limit else container
+                                            for key, container in self._containers.items()})
+
+    def intersection_len(self, other: GameBitmap) -> int:
+        """
+        Return the number of games in both bitmaps, without building the bitmap of those games.
+
+        >>> GameBitmap([1, 2, 3, 70000]).intersection_len(GameBitmap([2, 3, 4, 70000]))
+        3
+        >>> GameBitmap.full(70000).intersection_len(GameBitmap(range(60000, 80000)))
+        10000
+        """
+        total = 0
+        small, large = (self, other) if len(self._containers) <= len(other._containers) else (other, self)
+        for key, container in small._containers.items():
+            other_container = large._containers.get(key)
+            if other_container is not None:
+                total += _and_count(container, other_container)
+        return total
+
+    def __or__(self, other: GameBitmap) -> GameBitmap:
+        """
+        Return the games that are in either bitmap.
+
+        >>> list(GameBitmap([1, 70000]) | GameBitmap([2]))
+        [1, 2, 70000]
+        """
+        containers = dict(self._containers)
+        for key, container in other._containers.items():
+            containers[key] = _or_containers(containers[key], container) if key in containers else container
+        return GameBitmap._from_containers(dict(sorted(containers.items())))
+
+    def __sub__(self, other: GameBitmap) -> GameBitmap:
+        """
+        Return the games that are in this bitmap but not the other.
+
+        >>> list(GameBitmap([1, 2, 3]) - GameBitmap([2]))
+        [1, 3]
+        """
+        containers = {}
+        for key, container in self._containers.items():
+            other_container = other._containers.get(key)
+            result = container if other_container is None else _sub_containers(container, other_container)
+            if result:
+                containers[key] = result
+        return GameBitmap._from_containers(containers)
+
+    def __repr__(self) -> str:
+        return f"GameBitmap(<{len(self)} games>)"
+
+
+class GameIndex:
+    """
+    Column bitmaps over a games database: for each filterable column, the games having each value,
+    as well as the games having each move at each ply.
+
+    The games database can be anything mapping column names to equal length sequences
+    (like the columns from game_reader.read_games, or the pandas dataframe from game_reader.read_pgn).
+    """
+    size: int
+    columns: dict[str, dict[Any, GameBitmap]]
+    # If the games are a sample, maps each time control to the number of games with it in the whole dataset
+    population: Optional[dict[int, int]] = None
+    # Private Instance Attributes:
+    # - _plies: Maps (ply, move) to the games that played that move on that ply (starting at 0)
+    # - _all: The bitmap of every game in the database
+    # - _day_games: Maps (time control, day, count) to the games of that time control played on that day (see
+    #               trends.day_number) that are counted in count (one of trends.COUNTS: all of them for 'plays',
+    #               or those with that winner). Games without a known date are left out
+    _plies: dict[tuple[int, str], GameBitmap]
+    _all: GameBitmap
+    _day_games: dict[tuple[Any, int, str], GameBitmap]
+
+    def __init__(self, data: Any, max_ply: Optional[int] = None, ids: Optional[list[int]] = None) -> None:
+        """
+        Build the bitmaps for the given games database. Only the first max_ply moves of every game
+        are indexed, if given.
+
+        If ids is given, the games are part of a larger database, and ids[i] is the ID of the i-th game given.
+        Otherwise, the games have IDs 0, 1, 2, ...
+
+        Preconditions:
+        - ids is None or ids is sorted in increasing order
+        """
+        self.size = len(data['moves'])
+        self._all = GameBitmap.full(self.size) if ids is None else GameBitmap(ids)
+        if ids is None:
+            ids = range(self.size)
+
+        self.columns = {}
+        for column in FILTER_COLUMNS:
+            if column in data:
+                self.columns[column] = _group_ids(data[column], ids)
+
+        plies = {}
+        for game_id, moves in zip(ids, data['moves']):
+            if not isinstance(moves, list):
+                continue
+            for ply, move in enumerate(moves if max_ply is None else moves[:max_ply]):
+                plies.setdefault((ply, move), []).append(game_id)
+        self._plies = {key: GameBitmap(ply_ids) for key, ply_ids in plies.items()}
+
+        self._day_games = {}
+        if all(column in data for column in ['timestamp', 'time_control', 'winner']):
+            days = [day_number(timestamp) for timestamp in data['timestamp']]
+            groups = _group_ids(((tc, day, 'plays') for tc, day in zip(data['time_control'], days)), ids)
+            groups.update(_group_ids(zip(data['time_control'], days, data['winner']), ids))
+            self._day_games = {key: games.dense() for key, games in groups.items()
+                               if key[1] != NO_DAY and key[2] in COUNTS}
+
+    @classmethod
+    def merge(cls, indices: list[GameIndex]) -> GameIndex:
+        """
+        Return the index of all the games in the given indices, which must be parts of the same database
+        with no games in common.
+
+        The values of each column are ordered by the first game having them, just like an index built
+        from the whole database at once.
+        """
+        merged = cls.__new__(cls)
+        merged.size = sum(index.size for index in indices)
+        merged._all = _union(index.all_games() for index in indices)
+
+        columns = {}
+        for index in indices:
+            for column, values in index.columns.items():
+                for value, bitmap in values.items():
+                    columns.setdefault(column, {}).setdefault(value, []).append(bitmap)
+        merged.columns = {}
+        for column in FILTER_COLUMNS:
+            if column not in columns:
+                continue
+            unions = [(value, _union(bitmaps)) for value, bitmaps in columns[column].items()]
+            unions.sort(key=lambda item: item[1].first() if item[1] else merged.size)
+            merged.columns[column] = {value: bitmap for value, bitmap in unions if bitmap}
+
+        plies = {}
+        for index in indices:
+            for key, bitmap in index._plies.items():
+                plies.setdefault(key, []).append(bitmap)
+        merged._plies = {key: _union(bitmaps) for key, bitmaps in plies.items()}
+
+        day_games = {}
+        for index in indices:
+            for key, bitmap in index._day_games.items():
+                day_games.setdefault(key, []).append(bitmap)
+        merged._day_games = {key: _union(bitmaps).dense() for key, bitmaps in day_games.items()}
+        return merged
+
+    def all_games(self) -> GameBitmap:
+        """Return the bitmap of every game."""
+        return self._all
+
+    def column(self, column: str, value: Any) -> GameBitmap:
+        """Return the bitmap of games where the given column is the value. Empty if no such games."""
+        return self.columns.get(column, {}).get(value, GameBitmap())
+
+    def values(self, column: str) -> list[Any]:
+        """Return every value found in the given column."""
+        return list(self.columns.get(column, {}))
+
+    def ply_move(self, ply: int, move: str) -> GameBitmap:
+        """Return the bitmap of games that played the move on the given ply (the first move is ply 0)."""
+        return self._plies.get((ply, move), GameBitmap())
+
+    def sequence(self, move_sequence: list[str]) -> GameBitmap:
+        """Return the bitmap of games starting with the sequence of moves."""
+        games = self._all
+        for ply, move in enumerate(move_sequence):
+            games = games & self.ply_move(ply, move)
+        return games
+
+    def trends(self, games: GameBitmap) -> dict[int, TrendCounters]:
+        """
+        Return the number of the given games, and of each result, on each day they were played on, for each
+        time control. Time controls without dated games are left out.
+
+        The games of each time control, day and result are kept as a bitmap while indexing, so this only counts
+        the games each of them has in common with the given games, instead of going through the games.
+
+        >>> index = GameIndex({'moves': [[], [], [], []], 'time_control': [60, 60, 180, 60],
+        ...                    'winner': ['white', 'draw', 'white', 'black'], 'timestamp': [0, 86400, 86400, None]})
+        >>> {tc: counters.bucketed('day') for tc, counters in index.trends(index.all_games()).items()}
+        {60: {0: [1, 1, 0, 0], 1: [1, 0, 0, 1]}, 180: {1: [1, 1, 0, 0]}}
+        """
+        games = games.dense(0)
+        counts = {}
+        for (tc, day, count), day_games in self._day_games.items():
+            number = games.intersection_len(day_games)
+            if number:
+                counts.setdefault(tc, {tc_count: {} for tc_count in COUNTS})[count][day] = number
+        return {tc: TrendCounters(tc_counts['plays'], tc_counts) for tc, tc_counts in counts.items()}
+
+    def select(self, column: str, op: str, value: str) -> GameBitmap:
+        """
+        Return the bitmap of games where "column op value" holds.
+
+        Numeric values are compared as numbers, and values that cannot be compared
+        (like "N/A" for a missing elo) never match a comparison.
+
+        Preconditions:
+        - op in OPERATORS
+        """
+        result = GameBitmap()
+        for col_value, bitmap in self.columns.get(column, {}).items():
+            if _compare(col_value, op, value):
+                result = result | bitmap
+        return result
+
+
+def parse_condition(condition: str) -> Optional[tuple[str, str, str]]:
+    """
+    Parse a condition like "termination=Time forfeit" into (column, op, value).
+    Return None if no valid operator was found.
+
+    >>> parse_condition("elo_white >= 2000")
+    ('elo_white', '>=', '2000')
+    >>> parse_condition("termination=Time forfeit")
+    ('termination', '=', 'Time forfeit')
+    >>> parse_condition("apples") is None
+    True
+    """
+    for op in OPERATORS:
+        column, found, value = condition.partition(op)
+        if found:
+            return column.strip(), op, value.strip()
+    return None
+
+
+def _compare(col_value: Any, op: str, value: str) -> bool:
+    """
+    Return whether "col_value op value" holds, comparing as numbers if both are numbers.
+
+    >>> _compare("1850", ">", "1800")
+    True
+    >>> _compare("N/A", ">", "1800")
+    False
+    >>> _compare(180, "=", "180")
+    True
+    """
+    try:
+        left, right = float(col_value), float(value)
+    except (TypeError, ValueError):
+        left, right = str(col_value), value
+        if op not in {'=', '!='}:
+            return False
+
+    if op == '=':
+        return left == right
+    elif op == '!=':
+        return left != right
+    elif op == '>=':
+        return left >= right
+    elif op == '<=':
+        return left <= right
+    elif op == '>':
+        return left > right
+    else:
+        return left < right
+
+
+def _group_ids(column: Iterable[Any], ids: Iterable[int]) -> dict[Any, GameBitmap]:
+    """
+    Return a mapping from each value in the column to the bitmap of the IDs of the rows having that value.
+
+    >>> {k: list(v) for k, v in _group_ids(['a', 'b', 'a'], range(3)).items()}
+    {'a': [0, 2], 'b': [1]}
+    """
+    groups = {}
+    for game_id, value in zip(ids, column):
+        groups.setdefault(value, []).append(game_id)
+    return {value: GameBitmap(value_ids) for value, value_ids in groups.items()}
+
+
+def _union(bitmaps: Iterable[GameBitmap]) -> GameBitmap:
+    """
+    Return the union of all the bitmaps.
+
+    >>> list(_union([GameBitmap([1]), GameBitmap([3]), GameBitmap([2])]))
+    [1, 2, 3]
+    >>> len(_union([GameBitmap(range(0, 9000, 2)), GameBitmap(range(1, 9000, 2)), GameBitmap([70000])]))
+    9001
+    """
+    chunks = {}
+    for bitmap in bitmaps:
+        for key, container in bitmap._containers.items():
+            chunks.setdefault(key, []).append(container)
+
+    # The containers of each chunk are combined all at once, rather than two at a time
+    containers = {}
+    for key in sorted(chunks):
+        group = chunks[key]
+        if len(group) == 1:
+            containers[key] = group[0]
+        elif all(isinstance(container, array) for container in group) and sum(map(len, group)) <= ARRAY_LIMIT:
+            containers[key] = array('H', sorted(set().union(*group)))
+        else:
+            bits = 0
+            for container in group:
+                bits |= _to_bits(container)
+            containers[key] = _shrink(bits)
+    return GameBitmap._from_containers(containers)
+
+
+def _make_container(values: list[int]) -> Container:
+    """Return the smallest container for the given sorted chunk values."""
+    if len(values) <= ARRAY_LIMIT:
+        return array('H', values)
+    bits = 0
+    for value in values:
+        bits |= 1 << value
+    return bits
+
+
+def _container_values(container: Container) -> Iterable[int]:
+    """Return the values stored in the container, in increasing order."""
+    if isinstance(container, array):
+        return container
+    values = []
+    bits = container
+    while bits:
+        lowest = bits & -bits
+        values.append(lowest.bit_length() - 1)
+        bits ^= lowest
+    return values
+
+
+def _to_bits(container: Container) -> int:
+    """Return the container as a bitset."""
+    if isinstance(container, int):
+        return container
+    # Setting the bits in place in a buffer, as each bit set on an int would copy it
+    buffer = bytearray(1 << CHUNK_BITS >> 3)
+    for value in container:
+        buffer[value >> 3] |= 1 << (value & 7)
+    return int.from_bytes(buffer, 'little')
+
+
+def _shrink(bits: int) -> Container:
+    """Return the bitset as an array if it is sparse enough."""
+    if bits.bit_count() <= ARRAY_LIMIT:
+        return array('H', _container_values(bits))
+    return bits
+
+
+def _and_containers(a: Container, b: Container) -> Container:
+    if isinstance(a, int) and isinstance(b, int):
+        return _shrink(a & b)
+    elif isinstance(a, int):
+        return array('H', [value for value in b if a >> value & 1])
+    elif isinstance(b, int):
+        return array('H', [value for value in a if b >> value & 1])
+    else:
+        return array('H', sorted(set(a).intersection(b)))
+
+
+def _and_count(a: Container, b: Container) -> int:
+    """Return the number of values in both containers."""
+    if isinstance(a, int) and isinstance(b, int):
+        return (a & b).bit_count()
+    elif isinstance(a, int):
+        return sum(a >> value & 1 for value in b)
+    elif isinstance(b, int):
+        return sum(b >> value & 1 for value in a)
+    else:
+        return len(set(a).intersection(b))
+
+
+def _or_containers(a: Container, b: Container) -> Container:
+    if isinstance(a, array) and isinstance(b, array) and len(a) + len(b) <= ARRAY_LIMIT:
+        return array('H', sorted(set(a).union(b)))
+    return _shrink(_to_bits(a) | _to_bits(b))
+
+
+def _sub_containers(a: Container, b: Container) -> Container:
+    if isinstance(a, array):
+        if isinstance(b, int):
+            return array('H', [value for value in a if not b >> value & 1])
+        return array('H', sorted(set(a).difference(b)))
+    return _shrink(a & ~_to_bits(b))
+
+
+if __name__ == '__main__':
+    pass
+    # import doctest
+    # doctest.testmod(verbose=True)
+    # import python_ta
+
+    # python_ta.check_all(config={
+    #     'max-line-length': 120,
+    #     'disable': ['E1136', 'W0221'],
+    #     'extra-imports': ['array', 'Optional', 'Any', 'Iterable', 'Iterator', 'Union', 'trends'],
+    #     'max-nested-blocks': 4
+    # })
@@ -1,35 +1,422 @@
 """
-Functions to read a .pgn file, and to convert its main data to a pandas dataframe
+Functions to read a .pgn file, and to convert its main data to columns of data (or a pandas dataframe)
+
+The .pgn files may be compressed with gzip, bzip2 or zstandard (see pgn_stream).
+
+Malformed games (with illegal moves, or headers that cannot be read) are counted and skipped. If the cache is given
+a checkpoint directory, reading a file saves checkpoints along the way, and continues from the last one if it was
+interrupted (see checkpoints).
+
+python-chess and pandas take a long time to import, so they are only imported once games are actually read.
 """
-import chess
-import chess.pgn
-import pandas as pd
+from __future__ import annotations
+import calendar
+import math
+import os
+import random
+import sys
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Callable, Optional, TextIO
+
+from checkpoints import CHECKPOINT_EVERY, Checkpoint
+from pgn_stream import PgnLines, open_pgn, open_pgn_at
+
+if TYPE_CHECKING:
+    import chess.pgn
+    import pandas as pd
 
 # The data we will actually collect
-HEADERS = ['elo_white', 'elo_black', 'opening', 'time_control', 'winner', 'termination', 'moves']
+HEADERS = ['white', 'black', 'elo_white', 'elo_black', 'opening', 'time_control', 'winner', 'termination', 'timestamp',
+           'moves']
+# While parsing, games are handed to games_read (see read_games) after this many are read
+READ_BATCH = 500
+
+# Called with the columns of games as they are read (see read_games)
+GamesRead = Callable[[dict[str, list]], None]
 
 
-def read_pgn(filenames: list[str]) -> pd.DataFrame:
+class GameCache:
+    """
+    A cache of the games parsed from each .pgn file, so that files shared between datasets are only
+    parsed once.
+
+    Files are keyed by their path and modification time, so a file that changed is parsed again.
+    Once the estimated memory used goes over max_bytes, the least recently used files are evicted.
+
+    If checkpoint_dir is given, files are parsed with checkpoints saved there, so parsing a file that was
+    interrupted continues from its last checkpoint.
+    """
+    max_bytes: Optional[int]
+    checkpoint_dir: Optional[str]
+    malformed: dict[str, int]
+    # Private Instance Attributes:
+    # - _files: Maps a path to (modification time, parsed data, estimated size in bytes), least recently used first
+    # - _used: The estimated memory used by all the cached files, in bytes
+    _files: OrderedDict[str, tuple[int, dict[str, list], int]]
+    _used: int
+
+    def __init__(self, max_bytes: Optional[int] = None, checkpoint_dir: Optional[str] = None) -> None:
+        """
+        Create an empty cache. If max_bytes is not given, the cache has no memory limit.
+        malformed maps each file parsed to the number of malformed games skipped in it.
+        """
+        self.max_bytes = max_bytes
+        self.checkpoint_dir = checkpoint_dir
+        self.malformed = {}
+        self._files = OrderedDict()
+        self._used = 0
+
+    def get(self, filename: str, progress: Optional[Callable[[int], None]] = None,
+            games_read: Optional[GamesRead] = None) -> dict[str, list]:
+        """
+        Return the data of the .pgn file, parsing it only if it is not cached or has changed since.
+
+        If given, progress is called with the number of games read each time games are read,
+        and games_read with the columns of those games (see read_games).
+        """
+        mtime = os.stat(filename).st_mtime_ns
+        cached = self._files.get(filename)
+        if cached and cached[0] == mtime:
+            self._files.move_to_end(filename)
+            if progress:
+                progress(len(cached[1]['moves']))
+            _hand_on(cached[1], 0, games_read)
+            return cached[1]
+
+        if self.checkpoint_dir:
+            data, self.malformed[filename] = _read_pgn_file_checkpointed(filename, self.checkpoint_dir, progress,
+                                                                         games_read=games_read)
+        else:
+            data, self.malformed[filename] = _read_pgn_file(filename, progress, games_read)
+        self._evict(filename)
+        size = _estimate_size(data)
+        self._files[filename] = (mtime, data, size)
+        self._used += size
+        while self.max_bytes is not None and self._used > self.max_bytes and self._files:
+            self._evict(next(iter(self._files)))
+        return data
+
+    def is_cached(self, filename: str) -> bool:
+        """Return whether the file is cached and unchanged since it was parsed."""
+        cached = self._files.get(filename)
+        return cached is not None and cached[0] == os.stat(filename).st_mtime_ns
+
+    def is_parsed(self, filename: str) -> bool:
+        """
+        Return whether getting the file does not parse it: it is cached, or its checkpoint holds all of its games.
+        """
+        return self.is_cached(filename) or (self.checkpoint_dir is not None
+                                            and Checkpoint(self.checkpoint_dir, filename).done)
+
+    def memory_used(self) -> int:
+        """Return the estimated memory used by the cached games, in bytes."""
+        return self._used
+
+    def _evict(self, filename: str) -> None:
+        """Remove the file from the cache, if it is cached."""
+        if filename in self._files:
+            self._used -= self._files.pop(filename)[2]
+
+
+def read_pgn(filenames: list[str], cache: Optional[GameCache] = None,
+             progress: Optional[Callable[[int], None]] = None) -> pd.DataFrame:
     """
     Read the .pgn files given, writing its useful data into a single combined dataframe
+
+    If a cache is given, files that were already parsed are taken from the cache instead.
+    If given, progress is called with the number of games read each time games are read.
+    """
+    import pandas as pd
+
+    df = pd.DataFrame(read_games(filenames, cache, progress))
+    return df
+
+
+def read_games(filenames: list[str], cache: Optional[GameCache] = None,
+               progress: Optional[Callable[[int], None]] = None,
+               games_read: Optional[GamesRead] = None) -> dict[str, list]:
+    """
+    Read the .pgn files given, returning their useful data combined as a mapping of header to column.
+    This is read_pgn without the dataframe, so pandas is not needed.
+
+    If a cache is given, files that were already parsed are taken from the cache instead.
+    If given, progress is called with the number of games read each time games are read.
+
+    If given, games_read is called with the columns of the games read since it was last called, every
+    READ_BATCH games while parsing (and with all of a file's games at once if it is cached). Together,
+    the games it is given are the games returned, in the same order.
     """
     data = _build_headers(HEADERS)
     for filename in filenames:
-        with open(filename, 'r') as f:
-            game = chess.pgn.read_game(f)
-            while game:
-                data['elo_white'].append(game.headers.get('WhiteElo', "N/A"))
-                data['elo_black'].append(game.headers.get('BlackElo', "N/A"))
-                data['opening'].append(game.headers.get('Opening', "N/A"))
-                data['time_control'].append(_get_timecontrol(game.headers.get('TimeControl', "N/A")))
-                data['winner'].append(_get_winner(game.headers.get("Result", "N/A")))
-                data['termination'].append(game.headers.get("Termination", "N/A"))
-                data['moves'].append(_get_moves(game))
-
-                game = chess.pgn.read_game(f)  # Read next game
-
-    df = pd.DataFrame(data)
-    return df
+        file_data = cache.get(filename, progress, games_read) if cache \
+            else _read_pgn_file(filename, progress, games_read)[0]
+        for header in HEADERS:
+            data[header].extend(file_data[header])
+
+    return data
+
+
+def _read_pgn_file(filename: str, progress: Optional[Callable[[int], None]] = None,
+                   games_read: Optional[GamesRead] = None) -> tuple[dict[str, list], int]:
+    """
+    Read the single .pgn file given, returning its useful data as a mapping of header to column,
+    and the number of malformed games skipped.
+    If given, progress is called with 1 after each game is read, and games_read as in read_games.
+    """
+    data = _build_headers(HEADERS)
+    malformed = handed = 0
+    with open_pgn(filename) as f:
+        added = read_next_game(f, data)
+        while added is not None:
+            if not added:
+                malformed += 1
+            elif progress:
+                progress(1)
+            if len(data['moves']) - handed >= READ_BATCH:
+                handed = _hand_on(data, handed, games_read)
+
+            added = read_next_game(f, data)  # Read next game
+
+    _hand_on(data, handed, games_read)
+    return data, malformed
+
+
+def _read_pgn_file_checkpointed(filename: str, checkpoint_dir: str, progress: Optional[Callable[[int], None]] = None,
+                                every: int = CHECKPOINT_EVERY,
+                                games_read: Optional[GamesRead] = None) -> tuple[dict[str, list], int]:
+    r"""
+    Read the single .pgn file given like _read_pgn_file, continuing from its last checkpoint saved in
+    checkpoint_dir (if any), and saving a checkpoint every given number of games read.
+
+    A checkpoint is also saved if reading stops with an error (or Ctrl-C), so no more than the game being
+    read is lost. If given, progress and games_read are called with the games of the checkpoint first.
+
+    Reading gives the same games however often it is interrupted, even while saving a checkpoint (here,
+    when writing the state of the second checkpoint, before and after it is written):
+    >>> import checkpoints, tempfile
+    >>> directory = tempfile.mkdtemp()
+    >>> filename = os.path.join(directory, 'games.pgn')
+    >>> with open(filename, 'w') as f:
+    ...     _ = f.write(''.join(f'[TimeControl "60+0"]\n\n1. {move} 1-0\n\n' for move in 'e4 d4 c4 g3 b3'.split()))
+    >>> write = checkpoints._write_atomically
+    >>> def interrupted_write(path: str, content: bytes, writes: list, write_first: bool) -> None:
+    ...     writes.append(path)
+    ...     if write_first or len(writes) != 4:
+    ...         write(path, content)
+    ...     if len(writes) == 4:
+    ...         raise KeyboardInterrupt
+    >>> for write_first in [False, True]:
+    ...     checkpoint_dir, writes = tempfile.mkdtemp(), []
+    ...     checkpoints._write_atomically = lambda path, content: interrupted_write(path, content, writes, write_first)
+    ...     try:
+    ...         _ = _read_pgn_file_checkpointed(filename, checkpoint_dir, every=2)
+    ...     except KeyboardInterrupt:
+    ...         checkpoints._write_atomically = write
+    ...     print(_read_pgn_file_checkpointed(filename, checkpoint_dir, every=2) == _read_pgn_file(filename))
+    True
+    True
+    """
+    checkpoint = Checkpoint(checkpoint_dir, filename)
+    data = _build_headers(HEADERS)
+    checkpoint.load_games(data)
+    if progress and checkpoint.games:
+        progress(checkpoint.games)
+    _hand_on(data, 0, games_read)
+    if checkpoint.done:
+        return data, checkpoint.malformed
+
+    new_games = _build_headers(HEADERS)  # the games read since the last checkpoint
+    handed = 0  # the number of new games handed to games_read
+    offset, malformed, done = checkpoint.offset, checkpoint.malformed, False
+    try:
+        with open_pgn_at(filename, offset) as f:
+            added = read_next_game(f, new_games)
+            while added is not None:
+                offset = f.offset  # the game was read in full, so reading can continue from here
+                if not added:
+                    malformed += 1
+                elif progress:
+                    progress(1)
+                if len(new_games['moves']) - handed >= READ_BATCH:
+                    handed = _hand_on(new_games, handed, games_read)
+
+                if len(new_games['moves']) >= every:
+                    checkpoint.save(new_games, offset, malformed)
+                    _hand_on(new_games, handed, games_read)
+                    _extend(data, new_games)
+                    new_games, handed = _build_headers(HEADERS), 0
+                added = read_next_game(f, new_games)
+        done = True
+    finally:
+        # The last checkpoint is read back, as saving it may have been interrupted before or after it was saved
+        saved = Checkpoint(checkpoint_dir, filename)
+        if (saved.offset, saved.done) != (offset, done):
+            saved.save(new_games, offset, malformed, done)
+    _hand_on(new_games, handed, games_read)
+    _extend(data, new_games)
+
+    return data, malformed
+
+
+def read_next_game(handle: TextIO | PgnLines, data: dict[str, list]) -> Optional[bool]:
+    """
+    Read the next game of the .pgn file open as handle, adding its useful data to the columns of data.
+
+    Return True if the game was added, False if it was malformed (an illegal move, or headers that cannot
+    be read) and so skipped, or None at the end of the file.
+    """
+    import chess.pgn
+
+    try:
+        game = chess.pgn.read_game(handle)
+        if game is None:
+            return None
+        if game.errors:
+            return False
+        row = _game_row(game)
+    except ValueError:
+        return False
+
+    for header in HEADERS:
+        data[header].append(row[header])
+    return True
+
+
+def read_games_sample(filenames: list[str], rate: float, seed: int = 0,
+                      progress: Optional[Callable[[int], None]] = None,
+                      cache: Optional[GameCache] = None) -> tuple[dict[str, list], dict[int, int]]:
+    """
+    Read a random sample of the games in the .pgn files given, stratified by time control: from the games of
+    each time control, ceil(rate * number of games) of them are chosen uniformly at random.
+
+    Return the data of the sampled games (like read_games), and the total number of games of each time control.
+
+    Only the headers of the games that are not chosen are read, so this is much faster than reading every game.
+    If a cache is given, the sample of files it parsed already (see GameCache.is_parsed) is taken from their
+    games instead, without reading the files at all.
+    The same seed always gives the same sample (taken from the cache or not, unless a file has malformed games,
+    which are not cached).
+
+    Preconditions:
+    - 0 < rate <= 1
+    """
+    import chess.pgn
+
+    parsed = {filename: cache.get(filename) for filename in filenames if cache and cache.is_parsed(filename)}
+    strata = {}
+    game_id = 0
+    for filename in filenames:
+        if filename in parsed:
+            for tc in parsed[filename]['time_control']:
+                strata.setdefault(tc, []).append(game_id)
+                game_id += 1
+            continue
+        with open_pgn(filename) as f:
+            headers = chess.pgn.read_headers(f)
+            while headers is not None:
+                try:
+                    strata.setdefault(_get_timecontrol(headers.get('TimeControl', "N/A")), []).append(game_id)
+                except ValueError:
+                    pass  # malformed, so never chosen
+                game_id += 1
+                headers = chess.pgn.read_headers(f)
+
+    generator = random.Random(seed)
+    chosen = set()
+    for game_ids in strata.values():
+        chosen.update(generator.sample(game_ids, math.ceil(rate * len(game_ids))))
+
+    data = _build_headers(HEADERS)
+    game_id = 0
+    for filename in filenames:
+        if filename in parsed:
+            rows = [row for row in range(len(parsed[filename]['moves'])) if game_id + row in chosen]
+            for header in HEADERS:
+                data[header].extend(parsed[filename][header][row] for row in rows)
+            if progress and rows:
+                progress(len(rows))
+            game_id += len(parsed[filename]['moves'])
+            continue
+        with open_pgn(filename) as f:
+            while game_id in chosen or chess.pgn.skip_game(f):
+                if game_id in chosen:
+                    added = read_next_game(f, data)
+                    if added is None:
+                        break
+                    if added and progress:
+                        progress(1)
+                game_id += 1
+
+    return data, {tc: len(game_ids) for tc, game_ids in strata.items()}
+
+
+def _game_row(game: chess.pgn.Game) -> dict:
+    """
+    Return the useful data of the game, by header.
+
+    Raise a ValueError if the headers of the game cannot be read.
+    """
+    return {
+        'white': game.headers.get('White', "N/A"),
+        'black': game.headers.get('Black', "N/A"),
+        'elo_white': game.headers.get('WhiteElo', "N/A"),
+        'elo_black': game.headers.get('BlackElo', "N/A"),
+        'opening': game.headers.get('Opening', "N/A"),
+        'time_control': _get_timecontrol(game.headers.get('TimeControl', "N/A")),
+        'winner': _get_winner(game.headers.get("Result", "N/A")),
+        'termination': game.headers.get("Termination", "N/A"),
+        'timestamp': _get_timestamp(game.headers.get("UTCDate", game.headers.get("Date", "N/A")),
+                                    game.headers.get("UTCTime", "00:00:00")),
+        'moves': _get_moves(game)
+    }
+
+
+def _extend(data: dict[str, list], more: dict[str, list]) -> None:
+    """
+    Add the games of more to the end of the columns of data.
+
+    >>> data = {'moves': [['e4']]}
+    >>> _extend(data, {'moves': [['d4']]})
+    >>> data
+    {'moves': [['e4'], ['d4']]}
+    """
+    for header, column in more.items():
+        data[header].extend(column)
+
+
+def _hand_on(data: dict[str, list], start: int, games_read: Optional[GamesRead]) -> int:
+    """
+    Call games_read (if given) with the columns of the games of data from the start-th one on, if there are any.
+    Return the number of games in data, which is where the games to hand on next start.
+
+    >>> batches = []
+    >>> _hand_on({'moves': [['e4'], ['d4']]}, 1, batches.append)
+    2
+    >>> _hand_on({'moves': [['e4'], ['d4']]}, 2, batches.append)
+    2
+    >>> batches
+    [{'moves': [['d4']]}]
+    """
+    end = len(data['moves'])
+    if games_read and end > start:
+        games_read({header: column[start:] for header, column in data.items()})
+    return end
+
+
+def _estimate_size(data: dict[str, list]) -> int:
+    """
+    Return a rough estimate of the memory used by the parsed data of a file, in bytes.
+    Move strings are mostly shared between games, so only the lists holding them are counted.
+
+    >>> _estimate_size({'moves': []}) == sys.getsizeof([])
+    True
+    """
+    size = 0
+    for column in data.values():
+        size += sys.getsizeof(column)
+        for value in column:
+            size += sys.getsizeof(value)
+    return size
 
 
 def _build_headers(headers: list[str]) -> dict:
@@ -55,6 +442,24 @@ def _get_timecontrol(tc: str) -> int:
     return int(tc.partition("+")[0])
 
 
+def _get_timestamp(date: str, time: str) -> Optional[int]:
+    """
+    Return when the game was played, in seconds since 1970-01-01 UTC, from its UTCDate and UTCTime.
+    Return None if the date is unknown (lichess uses "????.??.??").
+
+    >>> _get_timestamp("2025.03.25", "19:57:59")
+    1742932679
+    >>> _get_timestamp("????.??.??", "00:00:00") is None
+    True
+    """
+    try:
+        year, month, day = (int(part) for part in date.split("."))
+        hour, minute, second = (int(part) for part in time.split(":"))
+    except ValueError:
+        return None
+    return calendar.timegm((year, month, day, hour, minute, second))
+
+
 def _get_moves(game: chess.pgn.Game) -> list[str]:
     moves = []
     board = game.board()
@@ -91,7 +496,8 @@ if __name__ == '__main__':
     # python_ta.check_all(config={
     #     'max-line-length': 120,
     #     'disable': ['E1136', 'W0221', 'E9998'],
-    #     'extra-imports': ['chess', 'chess.pgn', 'pandas'],
+    #     'extra-imports': ['chess', 'chess.pgn', 'pandas', 'os', 'sys', 'collections', 'Optional', 'Callable',
+    #                       'math', 'random', 'calendar', 'TextIO', 'checkpoints', 'pgn_stream'],
     #     'allowed-io': ['read_pgn'],
     #     'max-nested-blocks': 4
 
@@ -2,33 +2,19 @@
 main is where the program is run.
 """
 from openings_reader import get_openings
-from game_reader import read_pgn
-from move_tree import MoveTree
-from chess_data import ChessData
+from datasets import DatasetLoader
+from tree_builder import TreeBuilder
 from traverser import Traverser
 
-ALL_GAMES = [
-    "data/games/lichess_tournament_2025.03.26_G0j0ZKLB_2000-superblitz (1).pgn",
-    "data/games/lichess_tournament_2025.03.28_bHUDi9Ci_daily-rapid.pgn",
-    "data/games/lichess_tournament_2025.03.24_aByKLmHE_daily-superblitz.pgn",
-    "data/games/lichess_tournament_2025.03.25_45UeSiXu_daily-blitz.pgn",
-    "data/games/lichess_tournament_2025.03.25_OvDcYlTU_daily-rapid.pgn",
-    "data/games/lichess_tournament_2025.03.25_tqzGNmOv_daily-bullet.pgn"
-]
-
-BLITZ_ONLY = [
-    "data/games/lichess_tournament_2025.03.25_45UeSiXu_daily-blitz.pgn",
-    "data/games/lichess_tournament_2025.03.24_aByKLmHE_daily-superblitz.pgn"
-]
-
-BULLET_ONLY = [
-    "data/games/lichess_tournament_2025.03.25_tqzGNmOv_daily-bullet.pgn"
-]
-
-RAPID_ONLY = [
-    "data/games/lichess_tournament_2025.03.28_bHUDi9Ci_daily-rapid.pgn",
-    "data/games/lichess_tournament_2025.03.25_OvDcYlTU_daily-rapid.pgn"
-]
+# Set to build the tree in parallel, with the games split by this many first moves (see sharded_build)
+SHARD_DEPTH = None
+# Set to the fraction of games to sample, to show approximate stats while the exact ones are calculated
+SAMPLE_RATE = None
+# Set to store the tree as arrays, which takes much less memory but is built before exploring starts
+COMPACT_TREE = False
+# Set to a directory to save checkpoints in while reading games, so that reading large files continues from where
+# it stopped if interrupted
+CHECKPOINT_DIR = None
 
 
 def start() -> None:
@@ -43,10 +29,10 @@ def start() -> None:
     print("Starting Traverser...\n")
 
 
-def select_dataset() -> tuple[list[str], int]:
+def select_dataset() -> str:
     """
     Select the time control of the games that will be used in the opening explorer.
-    Also, return the timecontrol of the chosen dataset
+    Return the name of the chosen dataset (see datasets.DATASETS)
     """
     print("Select dataset to load:")
     print("1. All Games (60s, 180s, 300s, 600s)")
@@ -56,16 +42,16 @@ def select_dataset() -> tuple[list[str], int]:
     choice = input("Enter your choice (1-4): ")
 
     if choice == "1":
-        return ALL_GAMES, 180
+        return 'all'
     elif choice == "2":
-        return BLITZ_ONLY, 180
+        return 'blitz'
     elif choice == "3":
-        return BULLET_ONLY, 60
+        return 'bullet'
     elif choice == "4":
-        return RAPID_ONLY, 600
+        return 'rapid'
     else:
         print("Invalid choice. Loading all games by default.")
-        return ALL_GAMES, 180
+        return 'all'
 
 
 def max_moves() -> int:
@@ -93,11 +79,10 @@ if __name__ == '__main__':
     # python_ta.check_all(config={
     #     'max-line-length': 120,
     #     'disable': ['E1136', 'W0221'],
-    #     'extra-imports': ['move_tree',
-    #                       'chess_data',
-    #                       'traverser',
+    #     'extra-imports': ['traverser',
     #                       'openings_reader',
-    #                       'game_reader'],
+    #                       'datasets',
+    #                       'tree_builder'],
     #     'allowed-io': ['select_dataset', 'start', 'max_moves'],
     #     'max-nested-blocks': 4
     # })
@@ -107,18 +92,17 @@ if __name__ == '__main__':
     print("Loading openings...")
     openings_database = get_openings("data/openings", moves)
     print("Finished loading openings")
-    files, tc = select_dataset()
-    print("Loading games...")
-    games_database = read_pgn(files)
-    print("Finished loading games.")
-
-    print("Building tree...")
-    tree = MoveTree("", data=ChessData([], games_database))
-
-    for move_sequence in openings_database:
-        tree.insert_sequence(list(move_sequence), games_database, openings_database)
-
-    print("Finished building tree.")
-    traverser = Traverser(tree, tc)
+    dataset = select_dataset()
+    loader = DatasetLoader(openings_database, moves, shard_depth=SHARD_DEPTH and min(SHARD_DEPTH, moves),
+                           sample_rate=SAMPLE_RATE, compact=COMPACT_TREE, checkpoint_dir=CHECKPOINT_DIR)
+    if COMPACT_TREE:
+        print("Building tree...")
+        tree, index, tc = loader.load(dataset)
+        traverser = Traverser(tree, tc, index, loader)
+    else:
+        print("Building tree in the background. Type 'progress' to see how far along it is.")
+        builder = TreeBuilder(loader, dataset)
+        builder.start()
+        traverser = Traverser(builder.tree, builder.tc, None, loader, builder)
     traverser.output_help()
     traverser.interactive()
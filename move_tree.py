@@ -6,8 +6,8 @@ The root of a MoveTree should be the original starting board (no moves)
 """
 from __future__ import annotations
 from typing import Optional
-import pandas as pd
 from chess_data import ChessData
+from game_bitmap import GameBitmap, GameIndex
 
 
 class MoveTree:
@@ -25,10 +25,10 @@ class MoveTree:
         self.next_moves = next_moves if next_moves else []
         self.data = data if data else None
 
-    def insert_sequence(self, move_sequence: list[str], games_database: Optional[pd.DataFrame] = None,
+    def insert_sequence(self, move_sequence: list[str], games_database: Optional[GameIndex] = None,
                         openings_database: Optional[dict[tuple[str, ...], str]] = None) -> None:
-        """Insert the sequence of moves into this MoveTree. If games_database is provided, will update the
-        data for each node too based on the games
+        """Insert the sequence of moves into this MoveTree. If games_database (the indexed games) is provided,
+        will update the data for each node too based on the games
 
         If openings_database is provided, will label sequences with the respective name if found"""
         if not move_sequence:
@@ -43,9 +43,10 @@ class MoveTree:
             if not existing:  # existing subtree not found; create own
                 new_sequence = self.get_path() + [move_sequence[0]]
                 name = openings_database[tuple(new_sequence)] if tuple(new_sequence) in openings_database else None
-                data = ChessData(new_sequence, games_database, name)
                 new_seq = MoveTree(move_sequence[0], self)
-                new_seq.data = data
+                if games_database is not None:
+                    parent_games = self.data.games if self.data else None
+                    new_seq.data = ChessData(new_sequence, games_database, name, parent_games)
 
                 self.next_moves.append(new_seq)
                 new_seq.insert_sequence(move_sequence[1:], games_database, openings_database)
@@ -66,15 +67,44 @@ class MoveTree:
         path.reverse()  # since its in reverse order
         return path
 
-    def print_stats(self, tc: int) -> None:
+    def print_stats(self, tc: int, games_filter: Optional[GameBitmap] = None) -> None:
         """
-        prints out the stats for this node, given the time control.
+        prints out the stats for this node, given the time control. If games_filter is given,
+        only the games in it are counted.
         """
         if not self.data:
             print("There is no data associated with this board state.")
+        elif games_filter is not None:
+            self.data.filtered(games_filter).output_stats(tc)
         else:
             self.data.output_stats(tc)
 
+    def same_as(self, other: MoveTree) -> bool:
+        """
+        Return whether this tree and the other have the same moves in the same order, and the same opening
+        names and statistics at every node. Nodes without data only match nodes without data.
+
+        >>> games = GameIndex({'moves': [['e4'], ['d4']], 'time_control': [60, 60], 'winner': ['white', 'draw']})
+        >>> tree = build_tree(games, {('e4',): "King's Pawn Game", ('d4',): "Queen's Pawn Game"})
+        >>> tree.same_as(build_tree(games, {('e4',): "King's Pawn Game", ('d4',): "Queen's Pawn Game"}))
+        True
+        >>> tree.same_as(build_tree(games, {('d4',): "Queen's Pawn Game", ('e4',): "King's Pawn Game"}))
+        False
+        """
+        if self.move != other.move or len(self.next_moves) != len(other.next_moves):
+            return False
+        if self.data is None or other.data is None:
+            if self.data is not other.data:
+                return False
+        elif (self.data.name, self.data.plays, self.data.win_data, self.data.playrate) != \
+                (other.data.name, other.data.plays, other.data.win_data, other.data.playrate):
+            return False
+        return all(next_move.same_as(other_move) for next_move, other_move in zip(self.next_moves, other.next_moves))
+
+    def subtree_size(self) -> int:
+        """Return the number of nodes in this tree, including this node."""
+        return 1 + sum(next_move.subtree_size() for next_move in self.next_moves)
+
     def is_empty(self) -> bool:
         """Return whether this MoveTree is empty"""
         return self.move is None
@@ -112,6 +142,16 @@ class MoveTree:
             return str_so_far
 
 
+def build_tree(games_database: GameIndex, openings_database: dict[tuple[str, ...], str]) -> MoveTree:
+    """
+    Return a MoveTree of all the openings given, with the data of each node calculated from the indexed games.
+    """
+    tree = MoveTree("", data=ChessData([], games_database))
+    for move_sequence in openings_database:
+        tree.insert_sequence(list(move_sequence), games_database, openings_database)
+    return tree
+
+
 if __name__ == '__main__':
     pass
     # import doctest
@@ -121,7 +161,7 @@ if __name__ == '__main__':
     # python_ta.check_all(config={
     #     'max-line-length': 120,
     #     'disable': ['E1136', 'W0221'],
-    #     'extra-imports': ['Optional', 'pandas', 'chess_data'],
+    #     'extra-imports': ['Optional', 'game_bitmap', 'chess_data'],
     #     'allowed-io': ['MoveTree.print_stats'],
     #     'max-nested-blocks': 4
     # })
@@ -0,0 +1,460 @@
+"""
+Opening .pgn files as text streams, decompressing them on the fly if they are compressed.
+
+Lichess distributes its databases as .pgn.zst, and .pgn.gz and .pgn.bz2 are common too. The compression
+is detected from the first bytes of the file, so the file extension does not matter. Compressed files are
+decompressed in a background thread while the games are parsed, and are never written out to disk.
+
+Files made of many independent frames are decompressed in parallel, a batch of frames per thread: zstandard files
+with many frames (like those written by pzstd), and gzip files whose members record their size (BGZF, like those
+written by bgzip). The size of a zstandard frame is found by walking the headers
+of its blocks, without decompressing it. Other gzip files, and bzip2 files, are decompressed as a single stream.
+"""
+from __future__ import annotations
+import bz2
+import gzip
+import io
+import os
+import queue
+import threading
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Callable, Iterator, Optional, Protocol, TextIO
+
+GZIP_MAGIC = b'\x1f\x8b'
+BZIP2_MAGIC = b'BZh'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+# The magic numbers of zstandard skippable frames (holding metadata, like pzstd's frame sizes), once the last 4 bits
+# are cleared
+ZSTD_SKIPPABLE_MAGIC = 0x184D2A50
+# The flag of a gzip header saying it has extra fields
+GZIP_FEXTRA = 4
+
+# The size of each decompressed chunk handed to the parser, in bytes
+CHUNK_SIZE = 1 << 20
+# The most chunks decompressed ahead of the parser
+MAX_CHUNKS_AHEAD = 16
+# Lichess compresses with long distance matching, which needs a window larger than the default
+ZSTD_MAX_WINDOW = 1 << 31
+# The compressed size of each batch of frames decompressed by one thread, in bytes
+BATCH_SIZE = 1 << 20
+# Frames larger than this (compressed) are decompressed as a stream instead, so they are never held in memory whole
+MAX_PARALLEL_FRAME = 16 << 20
+
+
+def open_pgn(filename: str) -> TextIO:
+    """
+    Open the .pgn file for reading as text, decompressing it while reading if it is compressed with
+    gzip, bzip2 or zstandard.
+
+    Reading zstandard compressed files needs the zstandard package.
+    """
+    if detect_compression(filename) is None:
+        return open(filename, 'r')
+
+    return io.TextIOWrapper(_open_bytes(filename))
+
+
+def open_pgn_at(filename: str, offset: int = 0) -> PgnLines:
+    """
+    Open the .pgn file (decompressing it while reading, like open_pgn) for reading lines of text, starting at
+    the given byte offset of the decompressed file.
+
+    Preconditions:
+    - offset is the offset of the start of a line
+    """
+    return PgnLines(_open_bytes(filename), offset)
+
+
+def detect_compression(filename: str) -> Optional[str]:
+    """
+    Return the compression of the file ('gzip', 'bzip2' or 'zstd') from its first bytes,
+    or None if it is not compressed.
+    """
+    with open(filename, 'rb') as f:
+        magic = f.read(4)
+
+    if magic.startswith(GZIP_MAGIC):
+        return 'gzip'
+    elif magic.startswith(BZIP2_MAGIC):
+        return 'bzip2'
+    elif magic.startswith(ZSTD_MAGIC) or int.from_bytes(magic, 'little') & ~0xF == ZSTD_SKIPPABLE_MAGIC:
+        return 'zstd'
+    else:
+        return None
+
+
+def _open_bytes(filename: str) -> BinaryIO:
+    """Return a buffered binary stream of the file, decompressing it while reading if it is compressed."""
+    compression = detect_compression(filename)
+    if compression is None:
+        return open(filename, 'rb')
+    return io.BufferedReader(_DecompressingReader(_open_decompressed(filename, compression), filename), CHUNK_SIZE)
+
+
+def _open_decompressed(filename: str, compression: str) -> BinaryIO:
+    """
+    Return a binary stream of the decompressed file. Every gzip member, bzip2 stream or zstandard frame
+    is read, one after the other.
+
+    Preconditions:
+    - compression in {'gzip', 'bzip2', 'zstd'}
+    """
+    if compression == 'gzip':
+        with open(filename, 'rb') as f:
+            if _gzip_member_size(f) is None:
+                return gzip.open(filename, 'rb')
+        return _ParallelDecompressor(filename, _gzip_member_size, _decompress_gzip_member,
+                                     lambda: zlib.decompressobj(16 + zlib.MAX_WBITS))
+    elif compression == 'bzip2':
+        return bz2.open(filename, 'rb')
+
+    try:
+        import zstandard
+    except ImportError as error:
+        raise ImportError(f"Reading the zstandard compressed file {filename} needs the zstandard package "
+                          f"(pip install zstandard)") from error
+    return _ParallelDecompressor(filename, _zstd_frame_size, _decompress_zstd_frame,
+                                 zstandard.ZstdDecompressor(max_window_size=ZSTD_MAX_WINDOW).decompressobj)
+
+
+def _zstd_frame_size(f: BinaryIO) -> Optional[int]:
+    """
+    Return the compressed size of the zstandard frame at the position of the file, 0 at the end of the file,
+    or None if it is larger than MAX_PARALLEL_FRAME. The position of the file is left as is.
+
+    The size is found without decompressing the frame, by walking the headers of its blocks (like
+    ZSTD_findFrameCompressedSize). Raise a ValueError if there is no frame there, or it is truncated.
+
+    >>> import zstandard
+    >>> frame = zstandard.ZstdCompressor(write_checksum=True).compress(b'1. e4 e5 2. Nf3 Nc6 ' * 10000)
+    >>> _zstd_frame_size(io.BytesIO(frame + frame)) == len(frame)
+    True
+    """
+    start = f.tell()
+    try:
+        header = f.read(18)  # the longest frame header
+        if not header:
+            return 0
+        if len(header) >= 8 and int.from_bytes(header[:4], 'little') & ~0xF == ZSTD_SKIPPABLE_MAGIC:
+            return 8 + int.from_bytes(header[4:8], 'little')
+        if len(header) < 6 or not header.startswith(ZSTD_MAGIC):
+            raise ValueError("Not a zstandard frame")
+
+        descriptor = header[4]
+        single_segment = descriptor >> 5 & 1
+        size = 5 + (1 - single_segment) + [0, 1, 2, 4][descriptor & 3] + [single_segment, 2, 4, 8][descriptor >> 6]
+        while size <= MAX_PARALLEL_FRAME:
+            f.seek(start + size)
+            block = f.read(3)
+            if len(block) < 3:
+                raise ValueError("Truncated zstandard frame")
+            block_header = int.from_bytes(block, 'little')
+            block_type = block_header >> 1 & 3
+            if block_type == 3:
+                raise ValueError("Corrupt zstandard block")
+            size += 3 + (1 if block_type == 1 else block_header >> 3)  # RLE blocks hold a single byte
+            if block_header & 1:  # the last block, followed by the checksum if there is one
+                return size + 4 * (descriptor >> 2 & 1)
+        return None
+    finally:
+        f.seek(start)
+
+
+def _decompress_zstd_frame(frame: bytes) -> bytes:
+    """Return the decompressed contents of the zstandard frame (nothing for a skippable frame)."""
+    import zstandard
+
+    if int.from_bytes(frame[:4], 'little') & ~0xF == ZSTD_SKIPPABLE_MAGIC:
+        return b''
+    decompressor = zstandard.ZstdDecompressor(max_window_size=ZSTD_MAX_WINDOW).decompressobj()
+    contents = decompressor.decompress(frame)
+    if not decompressor.eof:
+        raise ValueError("Truncated zstandard frame")
+    return contents
+
+
+def _gzip_member_size(f: BinaryIO) -> Optional[int]:
+    """
+    Return the compressed size of the gzip member at the position of the file, as recorded in its header by BGZF
+    (in the BSIZE extra field), 0 at the end of the file, or None if it is not recorded. The position of the file
+    is left as is.
+
+    >>> member = bytes.fromhex('1f8b08040000000000ff0600424302001b00') + bytes(10)
+    >>> _gzip_member_size(io.BytesIO(member)), _gzip_member_size(io.BytesIO(gzip.compress(b'e4')))
+    (28, None)
+    """
+    start = f.tell()
+    try:
+        header = f.read(12)
+        if not header:
+            return 0
+        if len(header) < 12 or not header.startswith(GZIP_MAGIC) or not header[3] & GZIP_FEXTRA:
+            return None
+
+        extra = f.read(int.from_bytes(header[10:12], 'little'))
+        position = 0
+        while position + 4 <= len(extra):
+            length = int.from_bytes(extra[position + 2:position + 4], 'little')
+            if extra[position:position + 2] == b'BC' and length == 2:
+                return int.from_bytes(extra[position + 4:position + 6], 'little') + 1
+            position += 4 + length
+        return None
+    finally:
+        f.seek(start)
+
+
+def _decompress_gzip_member(member: bytes) -> bytes:
+    """Return the decompressed contents of the gzip member."""
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    contents = decompressor.decompress(member)
+    if not decompressor.eof:
+        raise ValueError("Truncated gzip member")
+    return contents
+
+
+class _StreamDecompressor(Protocol):
+    """A decompressor of one frame (or gzip member) given a piece at a time, like zlib.decompressobj()."""
+    eof: bool
+    unused_data: bytes
+
+    def decompress(self, data: bytes) -> bytes:
+        """Return the contents decompressed from data."""
+
+
+class _ParallelDecompressor:
+    """
+    A binary stream (supporting read and close) of a file of independent frames, decompressed by a pool of
+    threads: the frames are split into batches, each decompressed by one thread, and the batches handed on
+    in order. Frames whose size is unknown, or that are too large, are decompressed as a stream instead.
+    """
+    # Private Instance Attributes:
+    # - _file: The compressed file
+    # - _frame_size: Returns the size of the frame at the position of a file (see _zstd_frame_size)
+    # - _decompress: Returns the decompressed contents of a frame
+    # - _stream: Returns a decompressor for a frame given a piece at a time
+    # - _pool: The threads decompressing the batches
+    # - _workers: The number of threads
+    # - _chunks: The decompressed batches, in order
+    # - _current: What is left of the batch being read
+    _file: BinaryIO
+    _frame_size: Callable[[BinaryIO], Optional[int]]
+    _decompress: Callable[[bytes], bytes]
+    _stream: Callable[[], _StreamDecompressor]
+    _pool: ThreadPoolExecutor
+    _workers: int
+    _chunks: Iterator[bytes]
+    _current: memoryview
+
+    def __init__(self, filename: str, frame_size: Callable[[BinaryIO], Optional[int]],
+                 decompress: Callable[[bytes], bytes], stream: Callable[[], _StreamDecompressor],
+                 workers: Optional[int] = None) -> None:
+        """Open the file, to be decompressed by the given number of threads (by default, one per core)."""
+        self._file = open(filename, 'rb')
+        self._frame_size = frame_size
+        self._decompress = decompress
+        self._stream = stream
+        self._workers = workers or os.cpu_count() or 1
+        self._pool = ThreadPoolExecutor(self._workers)
+        self._chunks = self._decompressed_chunks()
+        self._current = memoryview(b'')
+
+    def read(self, size: int = -1) -> bytes:
+        """Return up to size decompressed bytes (the rest of the current batch if size is negative)."""
+        while not self._current:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return b''
+            self._current = memoryview(chunk)
+        if size < 0:
+            size = len(self._current)
+        data = bytes(self._current[:size])
+        self._current = self._current[size:]
+        return data
+
+    def close(self) -> None:
+        """Stop decompressing, and close the file."""
+        self._pool.shutdown(wait=True, cancel_futures=True)
+        self._file.close()
+
+    def _decompressed_chunks(self) -> Iterator[bytes]:
+        """Yield the decompressed contents of the file, a batch of frames at a time, in order."""
+        in_flight = deque()  # the batches being decompressed, in order
+        batch, batch_size = [], 0
+        size = self._frame_size(self._file)
+        while size != 0:
+            if size is None or batch_size >= BATCH_SIZE:
+                if batch:
+                    in_flight.append(self._pool.submit(_decompress_all, self._decompress, batch))
+                batch, batch_size = [], 0
+                while len(in_flight) >= (1 if size is None else 2 * self._workers):
+                    yield in_flight.popleft().result()
+
+            if size is None:  # every frame before it was handed on
+                yield from self._decompressed_stream()
+            else:
+                batch.append(self._file.read(size))
+                batch_size += size
+            size = self._frame_size(self._file)
+
+        if batch:
+            in_flight.append(self._pool.submit(_decompress_all, self._decompress, batch))
+        while in_flight:
+            yield in_flight.popleft().result()
+
+    def _decompressed_stream(self) -> Iterator[bytes]:
+        """Yield the decompressed contents of the frame at the position of the file, decompressing it as a stream."""
+        decompressor = self._stream()
+        while not decompressor.eof:
+            data = self._file.read(CHUNK_SIZE)
+            if not data:
+                raise EOFError("Compressed file ended before the end of a frame")
+            contents = decompressor.decompress(data)
+            if contents:
+                yield contents
+        self._file.seek(-len(decompressor.unused_data), io.SEEK_CUR)
+
+
+def _decompress_all(decompress: Callable[[bytes], bytes], frames: list[bytes]) -> bytes:
+    """Return the decompressed contents of the frames, one after the other."""
+    return b''.join(decompress(frame) for frame in frames)
+
+
+class PgnLines:
+    """
+    The lines of text of a .pgn file, read from its (decompressed) bytes while keeping track of the byte offset
+    reached. Only readline is supported, which is all python-chess needs to read games.
+
+    Lines end with '\\n', like in a file opened as text.
+    """
+    offset: int
+    # Private Instance Attributes:
+    # - _source: The binary stream of the (decompressed) file
+    _source: BinaryIO
+
+    def __init__(self, source: BinaryIO, offset: int = 0) -> None:
+        """Read the lines of the binary stream, starting at the given byte offset."""
+        self._source = source
+        self.offset = offset
+        if source.seekable():
+            source.seek(offset)
+            return
+        remaining = offset
+        while remaining:  # compressed files are decompressed up to the offset
+            skipped = len(source.read(min(remaining, CHUNK_SIZE)))
+            if not skipped:
+                raise ValueError(f"The offset {offset} is past the end of the file")
+            remaining -= skipped
+
+    def readline(self) -> str:
+        """Return the next line, or '' at the end of the file."""
+        line = self._source.readline()
+        self.offset += len(line)
+        return line.decode('utf-8', errors='replace').replace('\r\n', '\n')
+
+    def close(self) -> None:
+        """Close the file."""
+        self._source.close()
+
+    def __enter__(self) -> PgnLines:
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        self.close()
+
+
+class _DecompressingReader(io.RawIOBase):
+    """
+    A raw binary stream of a decompressed file, where the decompression is done by a background thread.
+
+    The decompressors release the GIL while working, so decompressing overlaps with parsing the games.
+    If the file is corrupt or truncated, reading raises an OSError.
+    """
+    # Private Instance Attributes:
+    # - _source: The decompressed stream read by the background thread
+    # - _filename: The name of the file being decompressed
+    # - _chunks: The chunks decompressed so far, ending with b'' at the end of the file. An exception is put
+    #            instead if decompressing failed
+    # - _current: What is left of the chunk being read
+    # - _closed: Set once the stream is closed, to stop the background thread
+    # - _thread: The thread decompressing the file
+    _source: BinaryIO
+    _filename: str
+    _chunks: queue.Queue
+    _current: memoryview
+    _closed: threading.Event
+    _thread: threading.Thread
+
+    def __init__(self, source: BinaryIO, filename: str) -> None:
+        super().__init__()
+        self._source = source
+        self._filename = filename
+        self._chunks = queue.Queue(MAX_CHUNKS_AHEAD)
+        self._current = memoryview(b'')
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._decompress, daemon=True)
+        self._thread.start()
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer: memoryview) -> int:
+        """Read decompressed bytes into the buffer, returning how many were read (0 at the end of the file)."""
+        if not self._current:
+            chunk = self._chunks.get()
+            if isinstance(chunk, Exception):
+                self._chunks.put(chunk)  # fail the same way on any later reads
+                raise OSError(f"{self._filename}: corrupt or truncated compressed file ({chunk})") from chunk
+            self._current = memoryview(chunk)
+            if not chunk:
+                self._chunks.put(chunk)  # stay at the end of the file for any later reads
+                return 0
+
+        size = min(len(buffer), len(self._current))
+        buffer[:size] = self._current[:size]
+        self._current = self._current[size:]
+        return size
+
+    def close(self) -> None:
+        if not self.closed:
+            self._closed.set()
+            self._thread.join()
+            self._source.close()
+        super().close()
+
+    def _decompress(self) -> None:
+        """Decompress the source into chunks until the end of the file, or until closed."""
+        try:
+            chunk = self._source.read(CHUNK_SIZE)
+            while chunk and not self._closed.is_set():
+                self._put(chunk)
+                chunk = self._source.read(CHUNK_SIZE)
+            self._put(b'')
+        except Exception as error:  # corrupt or truncated files; raised as an OSError when the parser reads
+            self._put(error)
+
+    def _put(self, chunk: bytes | Exception) -> None:
+        """Hand the chunk to the parser, giving up if the stream gets closed while waiting."""
+        while not self._closed.is_set():
+            try:
+                self._chunks.put(chunk, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+
+if __name__ == '__main__':
+    pass
+    # import doctest
+    # doctest.testmod(verbose=True)
+    # import python_ta
+
+    # python_ta.check_all(config={
+    #     'max-line-length': 120,
+    #     'disable': ['E1136', 'W0221'],
+    #     'extra-imports': ['bz2', 'gzip', 'io', 'os', 'queue', 'threading', 'zlib', 'zstandard', 'collections',
+    #                       'concurrent.futures', 'BinaryIO', 'Callable', 'Iterator', 'Optional', 'Protocol',
+    #                       'TextIO'],
+    #     'max-nested-blocks': 4
+    # })
@@ -8,37 +8,11 @@ from __future__ import annotations
 from typing import Optional
 from dataclasses import dataclass
 
-from traverser import Traverser
-from move_tree import MoveTree
-from chess_data import ChessData
-from game_reader import read_pgn
+from traverser import Traverser, COMMANDS
+from datasets import DatasetLoader
 from openings_reader import get_openings
 
 
-ALL_GAMES = [
-    "data/games/lichess_tournament_2025.03.26_G0j0ZKLB_2000-superblitz (1).pgn",
-    "data/games/lichess_tournament_2025.03.28_bHUDi9Ci_daily-rapid.pgn",
-    "data/games/lichess_tournament_2025.03.24_aByKLmHE_daily-superblitz.pgn",
-    "data/games/lichess_tournament_2025.03.25_45UeSiXu_daily-blitz.pgn",
-    "data/games/lichess_tournament_2025.03.25_OvDcYlTU_daily-rapid.pgn",
-    "data/games/lichess_tournament_2025.03.25_tqzGNmOv_daily-bullet.pgn"
-]
-
-BLITZ_ONLY = [
-    "data/games/lichess_tournament_2025.03.25_45UeSiXu_daily-blitz.pgn",
-    "data/games/lichess_tournament_2025.03.24_aByKLmHE_daily-superblitz.pgn"
-]
-
-BULLET_ONLY = [
-    "data/games/lichess_tournament_2025.03.25_tqzGNmOv_daily-bullet.pgn"
-]
-
-RAPID_ONLY = [
-    "data/games/lichess_tournament_2025.03.28_bHUDi9Ci_daily-rapid.pgn",
-    "data/games/lichess_tournament_2025.03.25_OvDcYlTU_daily-rapid.pgn"
-]
-
-
 @dataclass
 class SimulationConfig:
     """Configuration for setting up and running a chess explorer simulation."""
@@ -56,15 +30,11 @@ class ChessExplorerSimulation:
 
     def __init__(self, sim_config: SimulationConfig) -> None:
         """Initialize the chess simulation with selected data and a command list."""
-        game_file_paths = self._select_dataset(sim_config.dataset_choice)
-        games_database = read_pgn(game_file_paths)
         openings_database = get_openings(sim_config.opening_path, sim_config.max_moves_val)
+        loader = DatasetLoader(openings_database, sim_config.max_moves_val)
+        root, games_database, _ = loader.load(self._select_dataset(sim_config.dataset_choice))
 
-        root = MoveTree("", data=ChessData([], games_database))
-        for move_sequence in openings_database:
-            root.insert_sequence(list(move_sequence), games_database, openings_database)
-
-        self._traverser = Traverser(root, sim_config.default_tc)
+        self._traverser = Traverser(root, sim_config.default_tc, games_database, loader)
         self._command_log = sim_config.command_list
 
     def run(self) -> None:
@@ -85,21 +55,21 @@ class ChessExplorerSimulation:
 
     @staticmethod
     def _validate_command(cmd: str) -> bool:
-        return cmd in {'ls', 'cd', 'tree', 'info', 'settc', 'help', 'find', 'stats', 'timecontrols'}
+        return cmd in COMMANDS
 
     @staticmethod
-    def _select_dataset(choice: int) -> list[str]:
+    def _select_dataset(choice: int) -> str:
         if choice == 1:
-            return ALL_GAMES
+            return 'all'
         elif choice == 2:
-            return BLITZ_ONLY
+            return 'blitz'
         elif choice == 3:
-            return BULLET_ONLY
+            return 'bullet'
         elif choice == 4:
-            return RAPID_ONLY
+            return 'rapid'
         else:
             print("Invalid choice. Defaulting to all games.")
-            return ALL_GAMES
+            return 'all'
 
 
 if __name__ == '__main__':
@@ -137,14 +107,11 @@ if __name__ == '__main__':
     # python_ta.check_all(config={
     #     'max-line-length': 120,
     #     'disable': ['E1136', 'W0221'],
-    #     'extra-imports': ['move_tree',
-    #                       'openings_reader',
+    #     'extra-imports': ['openings_reader',
     #                       'Optional',
-    #                       'chess_data',
     #                       'traverser',
     #                       'Traverser',
-    #                       'read_pgn',
-    #                       'game_reader'],
+    #                       'datasets'],
     #     'allowed-io': ['ChessExplorerSimulation.run', 'ChessExplorerSimulation._select_dataset'],
     #     'max-nested-blocks': 4
     # })
@@ -0,0 +1,178 @@
+"""
+Building the MoveTree in parallel, by splitting the games and openings into shards.
+
+The games are partitioned by their first shard_depth moves, and each shard's subtree (along with the index
+of its games) is built in a separate process. The shards are then grafted under the few nodes shallower than
+shard_depth, which are built from the merged index. The result is identical to the tree from
+move_tree.build_tree: game IDs are kept the same in every shard, shards are grafted in the order the openings
+first reach them, and the playrate of the top node of each shard is calculated against the whole database.
+"""
+from __future__ import annotations
+from typing import Any, Optional
+
+from chess_data import ChessData
+from game_bitmap import GameIndex
+from game_reader import HEADERS
+from move_tree import MoveTree
+
+# The games of a shard (as columns), their IDs, and the openings of the shard
+Shard = tuple[dict[str, list], list[int], dict[tuple[str, ...], str]]
+
+
+def build_tree_sharded(games_database: Any, openings_database: dict[tuple[str, ...], str], max_moves: int,
+                       shard_depth: int = 1, processes: Optional[int] = None) -> tuple[MoveTree, GameIndex]:
+    """
+    Return a MoveTree of all the openings given, with the data of each node calculated from the games,
+    along with the index of the games. The shards are built with the given number of processes
+    (by default, one per core).
+
+    The processes are started with forkserver (or spawn, where forkserver is not available) rather than
+    fork, as the build usually runs on a thread (see tree_builder), and forking a process with threads
+    copies any locks the other threads hold, which may then never be released.
+
+    games_database is anything mapping column names to equal length sequences, like the columns
+    from game_reader.read_games.
+
+    >>> games = {'moves': [['e4', 'e5'], ['d4', 'd5'], ['e4', 'c5'], ['e4', 'e5'], ['d4']],
+    ...          'time_control': [60, 180, 60, 180, 60], 'winner': ['white', 'draw', 'black', 'white', 'black']}
+    >>> openings = {('e4', 'e5'): "Open Game", ('d4',): "Queen's Pawn Game", ('e4', 'c5'): "Sicilian Defense",
+    ...             ('d4', 'd5'): "Closed Game"}
+    >>> from move_tree import build_tree
+    >>> tree, index = build_tree_sharded(games, openings, 2, shard_depth=2, processes=2)
+    >>> tree.same_as(build_tree(GameIndex(games, 2), openings))
+    True
+
+    Preconditions:
+    - 1 <= shard_depth <= max_moves
+    """
+    # only imported when needed, as they are slow to import
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    columns = {header: list(games_database[header]) for header in HEADERS if header in games_database}
+    shards, shard_keys = _partition(columns, openings_database, shard_depth)
+
+    start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    with ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context(start_method)) as executor:
+        results = list(executor.map(_build_shard, shards, [max_moves] * len(shards),
+                                    [_time_controls(columns)] * len(shards), [shard_depth] * len(shards)))
+
+    index = GameIndex.merge([shard_index for shard_index, _ in results])
+    tree = MoveTree("", data=ChessData([], index))
+    # The nodes shallower than the shards are few; insert them like build_tree would
+    for move_sequence in openings_database:
+        tree.insert_sequence(list(move_sequence[:shard_depth - 1]), index, openings_database)
+
+    subtrees = {key: subtree for key, (_, subtree) in zip(shard_keys, results) if subtree}
+    for key in _opening_prefixes(openings_database, shard_depth):
+        parent = _find(tree, list(key[:-1]))
+        subtree = subtrees[key]
+        subtree.parent = parent
+        parent.next_moves.append(subtree)
+        _rebind(subtree, index)
+        subtree.data.rebind(index, parent.data.games)
+
+    return tree, index
+
+
+def _partition(columns: dict[str, list], openings_database: dict[tuple[str, ...], str],
+               shard_depth: int) -> tuple[list[Shard], list[Optional[tuple[str, ...]]]]:
+    """
+    Split the games and openings by their first shard_depth moves. Return the shards, and the key
+    (the first shard_depth moves) of each. Games with fewer moves are put in a shard with key None,
+    and no openings.
+    """
+    game_ids = {}
+    for game_id, moves in enumerate(columns['moves']):
+        key = tuple(moves[:shard_depth]) if isinstance(moves, list) and len(moves) >= shard_depth else None
+        game_ids.setdefault(key, []).append(game_id)
+
+    shard_openings = {}
+    for move_sequence, name in openings_database.items():
+        if len(move_sequence) >= shard_depth:
+            shard_openings.setdefault(move_sequence[:shard_depth], {})[move_sequence] = name
+
+    shards, keys = [], []
+    for key in list(game_ids) + [key for key in shard_openings if key not in game_ids]:
+        ids = game_ids.get(key, [])
+        shard_columns = {header: [column[game_id] for game_id in ids] for header, column in columns.items()}
+        shards.append((shard_columns, ids, shard_openings.get(key, {})))
+        keys.append(key)
+    return shards, keys
+
+
+def _build_shard(shard: Shard, max_moves: int, time_controls: list[int],
+                 shard_depth: int) -> tuple[GameIndex, Optional[MoveTree]]:
+    """
+    Return the index of the shard's games, and the subtree of its openings (None if it has none).
+    Every time control of the whole database is indexed, even those without games in this shard, so
+    that the data of each node has the same time controls as in a serial build.
+    """
+    columns, ids, openings_database = shard
+    index = GameIndex(columns, max_moves, ids)
+    index.columns['time_control'] = {tc: index.column('time_control', tc) for tc in time_controls}
+    if not openings_database:
+        return index, None
+
+    tree = MoveTree("", data=ChessData([], index))
+    for move_sequence in openings_database:
+        tree.insert_sequence(list(move_sequence), index, openings_database)
+    subtree = _find(tree, list(next(iter(openings_database))[:shard_depth]))
+    subtree.parent = None  # don't send the rest of the shard's tree back
+    return index, subtree
+
+
+def _time_controls(columns: dict[str, list]) -> list[int]:
+    """
+    Return the time controls of the games, in the order they first appear.
+
+    >>> _time_controls({'time_control': [60, 180, 60]})
+    [60, 180]
+    """
+    return list(dict.fromkeys(columns['time_control']))
+
+
+def _opening_prefixes(openings_database: dict[tuple[str, ...], str], length: int) -> list[tuple[str, ...]]:
+    """
+    Return the distinct first moves (of the given length) of the openings, in the order they first appear.
+
+    >>> _opening_prefixes({('e4', 'e5'): 'a', ('d4',): 'b', ('e4', 'c5'): 'c', ('e4',): 'd'}, 2)
+    [('e4', 'e5'), ('e4', 'c5')]
+    """
+    return list(dict.fromkeys(move_sequence[:length] for move_sequence in openings_database
+                              if len(move_sequence) >= length))
+
+
+def _find(tree: MoveTree, move_sequence: list[str]) -> MoveTree:
+    """
+    Return the node reached by the move sequence from the tree.
+
+    Preconditions:
+    - the move sequence is in the tree
+    """
+    node = tree
+    for move in move_sequence:
+        node = next(next_move for next_move in node.next_moves if next_move.move == move)
+    return node
+
+
+def _rebind(tree: MoveTree, index: GameIndex) -> None:
+    """Make the data of every node in the tree use the given index."""
+    tree.data.rebind(index)
+    for next_move in tree.next_moves:
+        _rebind(next_move, index)
+
+
+if __name__ == '__main__':
+    pass
+    # import doctest
+    # doctest.testmod(verbose=True)
+    # import python_ta
+
+    # python_ta.check_all(config={
+    #     'max-line-length': 120,
+    #     'disable': ['E1136', 'W0221'],
+    #     'extra-imports': ['concurrent.futures', 'multiprocessing', 'Any', 'Optional', 'chess_data', 'game_bitmap',
+    #                       'game_reader', 'move_tree'],
+    #     'max-nested-blocks': 4
+    # })
@@ -0,0 +1,68 @@
+"""
+Check that the explorer reaches its prompt quickly.
+
+Importing the modules used to browse a tree (main and proj2_simulation, with everything they import) must take
+at most IMPORT_BUDGET seconds, and must not import pandas or python-chess. Those are slow to import, and are
+only needed once games are actually read (see game_reader).
+
+Run `python startup_check.py`; it exits with status 1 if the budget is broken.
+"""
+import subprocess
+import sys
+
+# The most time importing the runtime modules may take, in seconds
+IMPORT_BUDGET = 0.25
+# The modules to import, as main.py and proj2_simulation.py would at startup
+RUNTIME_MODULES = ['main', 'proj2_simulation']
+# Modules that should only be imported once games are read
+HEAVY_MODULES = ['pandas', 'chess', 'numpy']
+# Each measurement is the fastest of this many runs, to ignore noise from the rest of the system
+RUNS = 5
+
+_MEASURE = f"""
+import sys, time
+start = time.perf_counter()
+import {', '.join(RUNTIME_MODULES)}
+print(time.perf_counter() - start)
+print(' '.join(module for module in {HEAVY_MODULES!r} if module in sys.modules))
+"""
+
+
+def measure_import() -> tuple[float, list[str]]:
+    """
+    Return how long importing the runtime modules takes in a fresh interpreter (the fastest of RUNS runs),
+    and which heavy modules got imported.
+    """
+    best, heavy = float('inf'), []
+    for _ in range(RUNS):
+        output = subprocess.run([sys.executable, '-c', _MEASURE], capture_output=True, text=True,
+                                check=True).stdout.splitlines()
+        best = min(best, float(output[0]))
+        heavy = output[1].split() if len(output) > 1 else []
+    return best, heavy
+
+
+def check_import_budget() -> bool:
+    """
+    Print out the measured import time and heavy modules imported, returning whether they are within budget.
+    """
+    elapsed, heavy = measure_import()
+    print(f"Importing {', '.join(RUNTIME_MODULES)} took {elapsed * 1000:.1f} ms "
+          f"(budget {IMPORT_BUDGET * 1000:.0f} ms)")
+    if heavy:
+        print(f"Heavy modules imported at startup: {', '.join(heavy)}")
+    return elapsed <= IMPORT_BUDGET and not heavy
+
+
+if __name__ == '__main__':
+    # import python_ta
+
+    # python_ta.check_all(config={
+    #     'max-line-length': 120,
+    #     'disable': ['E1136', 'W0221'],
+    #     'extra-imports': ['subprocess', 'sys'],
+    #     'allowed-io': ['check_import_budget'],
+    #     'max-nested-blocks': 4
+    # })
+
+    sys.exit(0 if check_import_budget() else 1)
@@ -5,13 +5,26 @@ Commands emulate navigation of a filesystem using the terminal; directories are
 """
 from typing import Optional
 from move_tree import MoveTree
-from chess_data import percentify
+from chess_data import ChessData, percentify, two_proportion_test
+from game_bitmap import GameBitmap, GameIndex, parse_condition
+from datasets import DATASETS, DatasetLoader
+from tree_builder import TreeBuilder
+from trends import BUCKETS, COUNTS, bucket_label, rolling_rates
+from tree_query import QUERY_FIELDS, NodeArrays, parse_query
 
 PADDING_RATES = 12
 PADDING_NEXT_MOVE = 12
 PADDING_NAME = 50
 PADDING_COMMAND = 25
-COMMANDS = ['ls', 'cd', 'tree', 'info', 'settc', 'help', 'find', 'stats', 'timecontrols']
+COMMANDS = ['ls', 'cd', 'tree', 'info', 'settc', 'help', 'find', 'stats', 'timecontrols', 'filter', 'load', 'progress',
+            'compare', 'diff', 'trend', 'query']
+RATE_STATS = ['playrate', 'white', 'black', 'draw']
+# The p-value under which a difference is marked significant, and its marker
+SIGNIFICANCE = [(0.001, '***'), (0.01, '**'), (0.05, '*')]
+# The number of buckets the rolling rate of a trend is taken over, if not given
+DEFAULT_WINDOWS = {'day': 7, 'week': 4, 'month': 3}
+# The most positions listed by the query command
+QUERY_LIMIT = 20
 
 
 class Traverser:
@@ -25,22 +38,54 @@ class Traverser:
     # - _current: The MoveTree node that the traverser currently is in
     # - _path: The current path from the true root to _current
     # - _timecontrol: The current timecontrol set for this MoveTree.
+    # - _index: The indexed games the MoveTree was built from, used for filtering
+    # - _filters: The active filter conditions, as (column, op, value)
+    # - _games_filter: The games satisfying every active filter, or None if no filters are set
+    # - _loader: Loads the other datasets for the load command
+    # - _builder: Builds the tree in the background, if the tree is still being built
+    # - _background: Whether datasets are loaded by building them in the background
+    # - _compared: The games of each dataset being compared, if the tree is of a comparison
+    # - _node_arrays: The flattened statistics of the home tree (with the filters applied) for the query command,
+    #                 or None if they have not been flattened since the tree or filters last changed
+    # - _arrays_built: The number of nodes the builder had built when _node_arrays was flattened, if building
     _home: MoveTree
     _path: list[str]
     _current: MoveTree
     _timecontrol: Optional[int] = None
-
-    def __init__(self, home: MoveTree, default_tc: Optional[int] = None) -> None:
+    _index: Optional[GameIndex]
+    _filters: list[tuple[str, str, str]]
+    _games_filter: Optional[GameBitmap]
+    _loader: Optional[DatasetLoader]
+    _builder: Optional[TreeBuilder]
+    _background: bool
+    _compared: dict[str, GameBitmap]
+    _node_arrays: Optional[NodeArrays]
+    _arrays_built: Optional[int]
+
+    def __init__(self, home: MoveTree, default_tc: Optional[int] = None, index: Optional[GameIndex] = None,
+                 loader: Optional[DatasetLoader] = None, builder: Optional[TreeBuilder] = None) -> None:
         """
         Create and bind a Traverser's home node to the given MoveTree.
 
         Sets the default time control to the given one, if provided. Otherwise, have no timecontrol
-        set.
+        set. The index of games is needed for the filter command, and the loader for the load command.
+
+        If the home node is the tree of a builder that is still running, the builder should be given.
+        Datasets loaded afterwards are then built in the background too.
         """
         self._home = home
         self._path = home.get_path()
         self._current = home
         self._timecontrol = default_tc
+        self._index = index
+        self._filters = []
+        self._games_filter = None
+        self._loader = loader
+        self._builder = builder
+        self._background = builder is not None
+        self._compared = {}
+        self._node_arrays = None
+        self._arrays_built = None
 
     def interactive(self) -> None:
         """
@@ -48,7 +93,8 @@ class Traverser:
         binded MoveTree.
         """
         while True:
-            raw_user_input = input(f"{self._path_to_str()}: ").strip()
+            building = "(building) " if self._builder and not self._builder.is_done() else ""
+            raw_user_input = input(f"{building}{self._path_to_str()}: ").strip()
             base, parameter = parse_command(raw_user_input)
             if validate_command(base):
                 self.handle_input(base, parameter)
@@ -58,6 +104,21 @@ class Traverser:
     def handle_input(self, command: str, param: Optional[str] = None) -> None:
         """
         Attempts to handle the command and parameter.
+
+        If the tree is being built, no data is added to the tree while the command runs.
+        """
+        if not self._builder:
+            self._handle_input(command, param)
+            return
+
+        with self._builder.lock:
+            if self._index is not self._builder.index:  # the games were indexed, or exact data replaced a sample
+                self._set_index(self._builder.index)
+            self._handle_input(command, param)
+
+    def _handle_input(self, command: str, param: Optional[str] = None) -> None:
+        """
+        Attempts to handle the command and parameter.
         """
         if command == 'ls':
             if param and param not in {'asc', 'desc', 'played'}:  # If the parameter was invalid
@@ -85,6 +146,20 @@ class Traverser:
             self.apply_traverse(param)
         elif command == 'timecontrols':
             self.timecontrols()
+        elif command == 'filter':
+            self.apply_filter(param)
+        elif command == 'load':
+            self.load_dataset(param)
+        elif command == 'progress':
+            self.output_progress()
+        elif command == 'compare':
+            self.compare_datasets(param)
+        elif command == 'diff':
+            self.output_diff(param)
+        elif command == 'trend':
+            self.output_trend(param)
+        elif command == 'query':
+            self.output_query(param)
 
     def _extract_tc(self, param: Optional[str] = None) -> Optional[int]:
         """
@@ -118,6 +193,18 @@ class Traverser:
         print(f"  {'settc (tc)':<{PADDING_COMMAND}}- Set the global time control")
         print(f"  {'timecontrols':<{PADDING_COMMAND}}- Display the time controls available")
         print(f"  {'tree':<{PADDING_COMMAND}}- Display the move tree constructed")
+        print(f"  {'filter [column op value]':<{PADDING_COMMAND}}- Only count games where the condition holds "
+              f"(e.g. termination=Time forfeit, elo_white>=2000). No parameter lists the filters set")
+        print(f"  {'filter clear':<{PADDING_COMMAND}}- Remove all filters")
+        print(f"  {'load (dataset)':<{PADDING_COMMAND}}- Switch to another dataset, one of {list(DATASETS)}")
+        print(f"  {'progress':<{PADDING_COMMAND}}- Display how far along building the tree is")
+        print(f"  {'compare (dataset)...':<{PADDING_COMMAND}}- Load two or more datasets into one tree to compare them")
+        print(f"  {'diff [stat] [A B]':<{PADDING_COMMAND}}- List the moves differing most between two compared "
+              f"datasets in stat, one of {RATE_STATS} (playrate by default)")
+        print(f"  {'trend [stat] [unit] [n]':<{PADDING_COMMAND}}- Display how stat changed over time, by unit (one of "
+              f"{BUCKETS}), along with its rate over the last n units")
+        print(f"  {'query (conditions)':<{PADDING_COMMAND}}- List the positions anywhere in the tree where every "
+              f"condition holds (e.g. black>55% and plays>=200 and depth<=6 and tc=180, or white_score<45%)")
 
     def timecontrols(self) -> None:
         """
@@ -125,6 +212,299 @@ class Traverser:
         """
         print("Time controls available: 60 sec, 180 sec, 300 sec, 600 sec")
 
+    def apply_filter(self, param: Optional[str] = None) -> None:
+        """
+        Add the condition given to the active filters, clear the filters if given "clear", or
+        list the active filters if no parameter is given.
+        """
+        if not param:
+            if not self._filters:
+                print("No filters set.")
+            for column, op, value in self._filters:
+                print(f"{column} {op} {value}")
+            return
+        elif param == 'clear':
+            self._filters = []
+            self._set_index(self._index)
+            print("Cleared all filters.")
+            return
+        elif not self._index:
+            print("filter: No games loaded to filter")
+            return
+
+        condition = parse_condition(param)
+        if not condition or condition[0] not in self._index.columns:
+            print(f"filter: Expected 'column op value' with column in {list(self._index.columns)}, got {param}")
+            return
+
+        self._filters.append(condition)
+        self._set_index(self._index)
+        print(f"Added filter {' '.join(condition)}. {len(self._games_filter)} games remaining.")
+
+    def _set_index(self, index: Optional[GameIndex]) -> None:
+        """
+        Use the given index of games, and calculate the games satisfying every active filter from it.
+        """
+        self._index = index
+        self._games_filter = None
+        self._node_arrays = None
+        if index is None:
+            return
+        for condition in self._filters:
+            selected = index.select(*condition)
+            self._games_filter = selected if self._games_filter is None else self._games_filter & selected
+
+    def load_dataset(self, param: Optional[str] = None) -> None:
+        """
+        Switch to the tree of the given dataset, staying at the same position. Filters are cleared, and the
+        time control is set to the dataset's default.
+        """
+        if not self._loader:
+            print("load: No datasets available to load")
+            return
+        elif param not in DATASETS:
+            print(f"load: Expected one of {list(DATASETS)}, got {param}")
+            return
+
+        print(f"Loading dataset {param}...")
+        self._stop_builder()
+        if self._background:
+            self._builder = TreeBuilder(self._loader, param)
+            self._builder.start()
+            home, index, tc = self._builder.tree, None, self._builder.tc
+        else:
+            try:
+                home, index, tc = self._loader.load(param)
+            except OSError as error:
+                print(f"load: Could not load dataset {param}: {error}")
+                return
+
+        self._switch_tree(home, index, tc)
+        self._compared = {}
+        if index:
+            print(f"Loaded dataset {param} ({index.size} games). Set global timecontrol to {tc}.")
+        else:
+            print(f"Building dataset {param} in the background. Set global timecontrol to {tc}.")
+
+    def _stop_builder(self) -> None:
+        """
+        Stop building the tree in the background, if it is, and wait until the build stopped: it reads through the
+        same cache of games (and checkpoints) as the loader, which must not be used by two threads at once.
+        """
+        if self._builder:
+            self._builder.stop()
+            self._builder.wait()
+            self._builder = None
+
+    def compare_datasets(self, param: Optional[str] = None) -> None:
+        """
+        Switch to a single tree built from the games of all the given datasets (separated by spaces), staying
+        at the same position, so that they can be compared with the diff command. Filters are cleared.
+
+        The tree is built before returning, even if datasets are otherwise built in the background.
+        """
+        names = param.split() if param else []
+        if not self._loader:
+            print("compare: No datasets available to compare")
+            return
+        elif len(names) < 2 or len(set(names)) < len(names) or any(name not in DATASETS for name in names):
+            print(f"compare: Expected two or more different datasets of {list(DATASETS)}, got {param}")
+            return
+
+        print(f"Loading datasets {', '.join(names)}...")
+        building = self._builder is not None and not self._builder.is_done()
+        self._stop_builder()
+        try:
+            home, index, compared = self._loader.load_comparison(names)
+        except OSError as error:
+            print(f"compare: Could not load datasets {param}: {error}")
+            if building:
+                print("The tree being built was stopped. Load its dataset again to finish building it.")
+            return
+
+        self._switch_tree(home, index, self._timecontrol)
+        self._compared = compared
+        for name, games in compared.items():
+            print(f"Loaded dataset {name} ({len(games)} games).")
+
+    def output_trend(self, param: Optional[str] = None) -> None:
+        """
+        Print out how the playrate (or the win rate given) of the current position changed over time at the
+        global timecontrol, by day, week or month. The rate over a rolling window of the last few buckets
+        is printed alongside.
+
+        The counts by day are taken from the games of each day kept by the index (see GameIndex.trends), without
+        going through the games, and are only counted once for each position (unless filters are set).
+        """
+        params = param.split() if param else []
+        stat = params.pop(0) if params and params[0] in RATE_STATS else 'playrate'
+        bucket = params.pop(0) if params and params[0] in BUCKETS else 'day'
+        window = int(params.pop(0)) if params and params[0].isdigit() and int(params[0]) > 0 \
+            else DEFAULT_WINDOWS[bucket]
+        if params:
+            print(f"trend: Expected a stat of {RATE_STATS}, a bucket of {BUCKETS} and/or a positive int, got {param}")
+            return
+
+        data = self._data(self._current)
+        parent = self._data(self._current.parent) if self._current.parent else data
+        if not data or not parent:
+            print("The stats of this position are not ready yet.")
+            return
+        elif self._timecontrol not in data.trends:
+            print(f"There are no dated games with timecontrol {self._timecontrol} reaching this position.")
+            return
+
+        counts = data.trends[self._timecontrol].bucketed(bucket)
+        plays = {key: bucket_counts[COUNTS.index('plays')] for key, bucket_counts in counts.items()}
+        if stat == 'playrate':
+            successes = plays
+            samples = {key: bucket_counts[COUNTS.index('plays')]
+                       for key, bucket_counts in parent.trends[self._timecontrol].bucketed(bucket).items()}
+        else:
+            successes = {key: bucket_counts[COUNTS.index(stat)] for key, bucket_counts in counts.items()}
+            samples = plays
+
+        print(f"Trend of {stat} by {bucket} at timecontrol {self._timecontrol}, "
+              f"with the rolling rate over {window} {bucket}s" + (" (from a sample)" if data.is_approximate() else ""))
+        print(f"{bucket.upper():<{PADDING_RATES * 2}}"
+              f"{'GAMES':<{PADDING_RATES}}"
+              f"{stat.upper():<{PADDING_RATES}}"
+              f"{'ROLLING':<{PADDING_RATES}}")
+        for key, _, rate, rolling_rate in rolling_rates(successes, samples, window):
+            print(f"{bucket_label(key, bucket):<{PADDING_RATES * 2}}"
+                  f"{plays.get(key, 0):<{PADDING_RATES}}"
+                  f"{percentify(rate, 2):<{PADDING_RATES}}"
+                  f"{percentify(rolling_rate, 2):<{PADDING_RATES}}")
+
+    def output_query(self, param: Optional[str] = None) -> None:
+        """
+        Print out the most played positions in the whole tree satisfying the conditions given (see
+        tree_query.parse_query), at the global timecontrol unless the query sets one. Each position is
+        listed with its path, which can be given to cd.
+        """
+        parsed = parse_query(param) if param else None
+        if parsed is None:
+            print(f"query: Expected conditions like 'black>55% and plays>=200 and depth<=6 and tc=180' on "
+                  f"{QUERY_FIELDS} (rates as percentages, or proportions up to 1), got {param}")
+            return
+        conditions, tc = parsed
+        tc = tc or self._timecontrol
+
+        building = self._builder and not self._builder.is_done()
+        # The statistics only change with the tree, the filters (see _set_index) or the nodes built since
+        nodes_built = self._builder.nodes_built if self._builder else None
+        if self._node_arrays is None or self._arrays_built != nodes_built:
+            self._node_arrays = NodeArrays(self._home, self._data)
+            self._arrays_built = nodes_built
+        node_arrays = self._node_arrays
+        nodes = node_arrays.select(conditions, tc)
+
+        print(f"Found {len(nodes)} positions out of {len(node_arrays)} at timecontrol {tc}"
+              + (f", the {QUERY_LIMIT} most played are listed" if len(nodes) > QUERY_LIMIT else "")
+              + (". The tree is still being built, so some positions are missing" if building else ""))
+        self._print_partial_note()
+        if not nodes:
+            return
+        print(f"{'PATH':<{PADDING_NAME}}"
+              f"{'PLAYS':<{PADDING_RATES}}"
+              f"{'PLAYRATE':<{PADDING_RATES}}"
+              f"{'WHITE WIN':<{PADDING_RATES}}"
+              f"{'BLACK WIN':<{PADDING_RATES}}"
+              f"{'DRAW':<{PADDING_RATES}}")
+        for node in nodes[:QUERY_LIMIT]:
+            data = self._data(node)
+            print(f"{'/'.join(['~'] + node_arrays.path(node)):<{PADDING_NAME}}"
+                  f"{round(data.get_plays(tc)):<{PADDING_RATES}}"
+                  f"{_rate(data, 'playrate', tc):<{PADDING_RATES}}"
+                  f"{_rate(data, 'white', tc):<{PADDING_RATES}}"
+                  f"{_rate(data, 'black', tc):<{PADDING_RATES}}"
+                  f"{_rate(data, 'draw', tc):<{PADDING_RATES}}")
+
+    def _switch_tree(self, home: MoveTree, index: Optional[GameIndex], tc: Optional[int]) -> None:
+        """
+        Switch to the given tree, built from the games of the index, staying at the same position if it is
+        in the tree. Filters are cleared, and the time control is set to tc.
+        """
+        path = self._path
+        self._home = home
+        self._current = home
+        self._path = home.get_path()
+        self._timecontrol = tc
+        self._filters = []
+        self._set_index(index)
+        if path:
+            self.apply_traverse("/".join(path))
+
+    def output_diff(self, param: Optional[str] = None) -> None:
+        """
+        Print out how much stat (the playrate by default) differs for each move from the current position between
+        two of the compared datasets (the first two by default), along with the p-value of the difference.
+        The moves are ordered by p-value, so that a large difference found in a handful of games doesn't come before
+        a smaller one that is significant, then by how large the difference is. Moves the stat has no samples for in
+        one of the datasets (so no difference to measure) are listed last, with a '-' for what can't be calculated.
+        The games of every timecontrol are counted.
+        """
+        params = param.split() if param else []
+        stat = params.pop(0) if params and params[0] in RATE_STATS else 'playrate'
+        if not self._compared:
+            print("diff: No datasets are being compared; use compare first")
+            return
+        elif params and (len(params) != 2 or any(name not in self._compared for name in params)):
+            print(f"diff: Expected a stat of {RATE_STATS} and/or two of {list(self._compared)}, got {param}")
+            return
+        name_a, name_b = params if params else list(self._compared)[:2]
+
+        rows = []
+        for move in self._current.next_moves:
+            data = self._data(move)
+            successes_a, samples_a = data.filtered(self._compared[name_a]).get_counts(stat, None)
+            successes_b, samples_b = data.filtered(self._compared[name_b]).get_counts(stat, None)
+            rate_a = successes_a / samples_a if samples_a else None
+            rate_b = successes_b / samples_b if samples_b else None
+            p_value = two_proportion_test(successes_a, samples_a, successes_b, samples_b) \
+                if samples_a and samples_b else None
+            rows.append((move.move, rate_a, rate_b, p_value))
+
+        if not rows:
+            print("There's no more moves to list...")
+            return
+        print(f"Difference in {stat} between {name_a} and {name_b}:")
+        print(f"{'NEXT MOVE':<{PADDING_NEXT_MOVE}}"
+              f"{name_a.upper():<{PADDING_RATES}}"
+              f"{name_b.upper():<{PADDING_RATES}}"
+              f"{'DIFFERENCE':<{PADDING_RATES}}"
+              f"{'P-VALUE':<{PADDING_RATES}}")
+        rows.sort(key=lambda row: (True, 0.0, 0.0) if row[3] is None else (False, row[3], -abs(row[1] - row[2])))
+        for move, rate_a, rate_b, p_value in rows:
+            if p_value is None:
+                difference = significance = '-'
+            else:
+                marker = next((marker for level, marker in SIGNIFICANCE if p_value < level), '')
+                difference, significance = f'{(rate_a - rate_b) * 100:+.2f}%', f'{p_value:.4f} {marker}'
+            print(f"{move:<{PADDING_NEXT_MOVE}}"
+                  f"{'-' if rate_a is None else percentify(rate_a, 2):<{PADDING_RATES}}"
+                  f"{'-' if rate_b is None else percentify(rate_b, 2):<{PADDING_RATES}}"
+                  f"{difference:<{PADDING_RATES}}"
+                  f"{significance:<{PADDING_RATES}}")
+
+    def output_progress(self) -> None:
+        """
+        Print out how far along building the tree is.
+        """
+        if not self._builder or self._builder.is_done():
+            print("The tree is fully built.")
+        else:
+            print(self._builder.progress())
+
+    def _data(self, node: MoveTree) -> Optional[ChessData]:
+        """
+        Return the data of the node, restricted to the filtered games if any filters are set.
+        Return None if the node has no data yet.
+        """
+        if self._games_filter is None or node.data is None:
+            return node.data
+        return node.data.filtered(self._games_filter)
+
     def output_tree(self) -> None:
         """
         Output the MoveTree, RELATIVE to the current node.
@@ -137,7 +517,11 @@ class Traverser:
         """
         if not tc:
             tc = self._timecontrol  # set to global version
-        self._current.print_stats(tc)
+        if not self._current.data and self._builder and not self._builder.is_done():
+            print(f"The stats of this position are not ready yet. {self._builder.progress()}")
+            return
+        self._current.print_stats(tc, self._games_filter)
+        self._print_partial_note()
 
     def ls(self, param: Optional[str] = None) -> None:
         """
@@ -149,19 +533,30 @@ class Traverser:
         Preconditions:
          - param in {'asc', 'desc', 'played'}
         """
-        next_moves = self._current.next_moves
+        next_moves = [(move.move, self._data(move)) for move in self._current.next_moves]
         if param == "asc":
-            next_moves = sorted(next_moves, key=lambda move: move.data.get_playrate(self._timecontrol))
+            next_moves = sorted(next_moves, key=lambda move: _playrate(move[1], self._timecontrol))
         elif param == "desc":
-            next_moves = sorted(next_moves, key=lambda move: move.data.get_playrate(self._timecontrol), reverse=True)
+            next_moves = sorted(next_moves, key=lambda move: _playrate(move[1], self._timecontrol), reverse=True)
         elif param == "played":
-            next_moves = [move for move in next_moves if move.data.playrate[self._timecontrol] != 0]
+            next_moves = [move for move in next_moves if _playrate(move[1], self._timecontrol) != 0]
 
         self._print_moves(next_moves)
+        self._print_partial_note()
 
-    def _print_moves(self, moves: list[MoveTree], tc: Optional[int] = None) -> None:
+    def _print_partial_note(self) -> None:
         """
-        Print out the moves in a pretty formatted manner. If not given any tc, use default.
+        Print out which games the stats shown are from, if the tree is being built and they are not from every
+        game of the dataset yet (see TreeBuilder.partial_note).
+        """
+        note = self._builder.partial_note() if self._builder else None
+        if note:
+            print(note)
+
+    def _print_moves(self, moves: list[tuple[str, Optional[ChessData]]], tc: Optional[int] = None) -> None:
+        """
+        Print out the moves (with their data) in a pretty formatted manner. If not given any tc, use default.
+        Moves without data yet are listed as still building.
         """
         if not moves:
             print("There's no more moves to list...")
@@ -175,13 +570,16 @@ class Traverser:
               f"{'DRAW':<{PADDING_RATES}}"
               f"{'NAME':<{PADDING_NAME}}")
 
-        for move in moves:
-            print(f"{move.move:<{PADDING_NEXT_MOVE}}"
-                  f"{percentify(move.data.get_playrate(tc), 2):<{PADDING_RATES}}"
-                  f"{percentify(move.data.get_winrate("white", tc), 2):<{PADDING_RATES}}"
-                  f"{percentify(move.data.get_winrate("black", tc), 2):<{PADDING_RATES}}"
-                  f"{percentify(move.data.get_winrate("draw", tc), 2):<{PADDING_RATES}}"
-                  f"{move.data.get_name():<{PADDING_NAME}}")
+        for move, data in moves:
+            if not data:
+                print(f"{move:<{PADDING_NEXT_MOVE}}(still building...)")
+                continue
+            print(f"{move:<{PADDING_NEXT_MOVE}}"
+                  f"{_rate(data, 'playrate', tc):<{PADDING_RATES}}"
+                  f"{_rate(data, 'white', tc):<{PADDING_RATES}}"
+                  f"{_rate(data, 'black', tc):<{PADDING_RATES}}"
+                  f"{_rate(data, 'draw', tc):<{PADDING_RATES}}"
+                  f"{data.get_name():<{PADDING_NAME}}")
 
     def apply_traverse(self, param: str) -> None:
         """
@@ -191,6 +589,8 @@ class Traverser:
         test = self._current
         test_path = self._path.copy()
         for move in moves:
+            if move == "":  # like a terminal, "a//b" and "a/" are the same as "a/b" and "a"
+                continue
             if move == "~":
                 test = self._home
                 test_path = self._home.get_path()
@@ -212,11 +612,34 @@ class Traverser:
                 self._current = test
                 self._path = test_path
 
+        if self._builder and not self._builder.is_done():
+            self._builder.prioritize(self._current)
+
     def _path_to_str(self) -> str:
 
         return "/" + "/".join(self._path)
 
 
+def _playrate(data: Optional[ChessData], tc: Optional[int]) -> float:
+    """Return the playrate of the data for the timecontrol, or 0.0 if there is no data yet."""
+    return data.get_playrate(tc) if data else 0.0
+
+
+def _rate(data: ChessData, stat: str, tc: Optional[int]) -> str:
+    """
+    Return the win rate of stat (or the playrate, if stat is 'playrate') as a percentage. If the data is
+    approximate, the margin of error (the furthest end of the 95% confidence interval) is added.
+
+    Preconditions:
+    - stat in {'black', 'white', 'draw', 'playrate'}
+    """
+    value = data.get_playrate(tc) if stat == 'playrate' else data.get_winrate(stat, tc)
+    if not data.is_approximate():
+        return percentify(value, 2)
+    low, high = data.get_interval(stat, tc)
+    return f"{percentify(value, 1)}±{round(max(value - low, high - value) * 100, 1)}"
+
+
 def parse_command(command: str) -> tuple[str, Optional[str]]:
     """
     Parse command into the actual command and param as a tuple (choice, param).
@@ -262,7 +685,8 @@ if __name__ == '__main__':
     # python_ta.check_all(config={
     #     'max-line-length': 120,
     #     'disable': ['E1136', 'W0221'],
-    #     'extra-imports': ['move_tree', 'percentify', 'Optional', 'chess_data'],
+    #     'extra-imports': ['move_tree', 'percentify', 'two_proportion_test', 'Optional', 'chess_data',
+    #                       'game_bitmap', 'datasets', 'tree_builder', 'trends', 'tree_query'],
     #     'allowed-io': ['Traverser._print_moves',
     #                    'Traverser.output_tree',
     #                    'Traverser.output_help',
@@ -271,6 +695,13 @@ if __name__ == '__main__':
     #                    'Traverser.apply_traverse',
     #                    'Traverser.handle_input',
     #                    'Traverser.timecontrols',
+    #                    'Traverser.apply_filter',
+    #                    'Traverser.load_dataset',
+    #                    'Traverser.output_progress',
+    #                    'Traverser.compare_datasets',
+    #                    'Traverser.output_diff',
+    #                    'Traverser.output_trend',
+    #                    'Traverser.output_query',
     #                    'Traverser.interactive'],
     #     'max-nested-blocks': 4
     # })
@@ -0,0 +1,119 @@
+"""
+Compare the memory used by, and the speed of traversing, the MoveTree and the compact tree (see compact_tree).
+
+Both trees are built from the same dataset. The memory of each tree counts everything allocated while building it
+(the nodes, their data and the bitmaps of their games), but not the index of the games, which both share.
+Traversing visits every node, reading its playrate and win rates, like the ls command does at each position.
+The compact tree is traversed both through its MoveTree interface (which creates a view of each node visited)
+and through its arrays directly. Even through its arrays, it is several times slower to traverse than the MoveTree
+(each count read is a method call working out where the count is), so it trades speed for memory.
+
+Run `python tree_benchmark.py [dataset] [moves]`, by default with the bullet dataset and 8 moves.
+"""
+import sys
+import time
+import tracemalloc
+from typing import Callable
+
+from compact_tree import TreeArrays
+from datasets import DATASETS
+from game_bitmap import GameIndex
+from game_reader import read_games
+from move_tree import MoveTree, build_tree
+from openings_reader import get_openings
+
+# Each time is the fastest of this many runs, to ignore noise from the rest of the system
+RUNS = 5
+
+
+def traverse(tree: MoveTree, tc: int) -> int:
+    """Visit every node of the tree, reading its statistics for the timecontrol. Return the number of nodes."""
+    visited = 0
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        data = node.data
+        data.get_playrate(tc)
+        for winner in ['white', 'black', 'draw']:
+            data.get_winrate(winner, tc)
+        visited += 1
+        stack.extend(node.next_moves)
+    return visited
+
+
+def traverse_arrays(arrays: TreeArrays, tc: int) -> int:
+    """
+    Visit every node of the compact tree through its arrays directly (without creating a view of each node),
+    reading its statistics for the timecontrol. Return the number of nodes.
+    """
+    visited = 0
+    stack = [0]
+    while stack:
+        node = stack.pop()
+        plays = arrays.count(node, tc, 'plays')
+        prev_plays = arrays.count(node, tc, 'prev_plays')
+        _ = plays / prev_plays if prev_plays else 0.0
+        for winner in ['white', 'black', 'draw']:
+            _ = arrays.count(node, tc, winner) / plays if plays else 0.0
+        visited += 1
+        stack.extend(arrays.children(node))
+    return visited
+
+
+def measure_memory(build: Callable[[], object]) -> tuple[object, int]:
+    """Return what build returns, and the memory allocated while building it (and still used), in bytes."""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    built = build()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return built, used
+
+
+def measure_time(function: Callable[[], object]) -> float:
+    """Return the fastest time taken by the function over RUNS runs, in seconds."""
+    best = float('inf')
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run_benchmark(dataset: str, moves: int) -> None:
+    """Print out the memory and traversal time of both trees, built from the dataset to the given depth."""
+    files, tc = DATASETS[dataset]
+    games_database = GameIndex(read_games(files), moves)
+    openings_database = get_openings("data/openings", moves)
+
+    tree, tree_memory = measure_memory(lambda: build_tree(games_database, openings_database))
+    arrays, arrays_memory = measure_memory(lambda: TreeArrays(tree, games_database))
+    compact = arrays.root()
+    nodes = traverse(tree, tc)
+    assert traverse(compact, tc) == traverse_arrays(arrays, tc) == nodes == len(arrays)
+
+    tree_time = measure_time(lambda: traverse(tree, tc))
+    compact_time = measure_time(lambda: traverse(compact, tc))
+    arrays_time = measure_time(lambda: traverse_arrays(arrays, tc))
+    print(f"{nodes} nodes from {games_database.size} games of the {dataset} dataset, up to {moves} moves")
+    print(f"{'':<10}{'MEMORY':>14}{'PER NODE':>12}{'TRAVERSAL':>14}{'(ARRAYS)':>14}")
+    print(f"{'MoveTree':<10}{f'{tree_memory / 1024:.0f} KiB':>14}{f'{tree_memory / nodes:.0f} B':>12}"
+          f"{f'{tree_time * 1000:.1f} ms':>14}")
+    print(f"{'compact':<10}{f'{arrays_memory / 1024:.0f} KiB':>14}{f'{arrays_memory / nodes:.0f} B':>12}"
+          f"{f'{compact_time * 1000:.1f} ms':>14}{f'{arrays_time * 1000:.1f} ms':>14}")
+    print(f"The compact tree's arrays alone take {arrays.memory_used() / nodes:.0f} B per node")
+
+
+if __name__ == '__main__':
+    # import python_ta
+
+    # python_ta.check_all(config={
+    #     'max-line-length': 120,
+    #     'disable': ['E1136', 'W0221'],
+    #     'extra-imports': ['sys', 'time', 'tracemalloc', 'Callable', 'compact_tree', 'datasets', 'game_bitmap',
+    #                       'game_reader', 'move_tree', 'openings_reader'],
+    #     'allowed-io': ['run_benchmark'],
+    #     'max-nested-blocks': 4
+    # })
+
+    run_benchmark(sys.argv[1] if len(sys.argv) > 1 else 'bullet', int(sys.argv[2]) if len(sys.argv) > 2 else 8)
@@ -0,0 +1,386 @@
+"""
+TreeBuilder builds the MoveTree of a dataset in the background, so that the tree can be navigated
+while the games are still being read.
+
+The tree of openings is inserted right away, without any data. The games are then read, and indexed in
+batches as they are read: every so often, the games read since the last snapshot of the index are indexed
+and merged into it. Stats are then shown from the games read so far, long before every game is read.
+While reading, only the data of the nodes in view (the position looked at by the user, its previous moves
+and its next moves) is calculated, from each new snapshot and again after each batch of games read for
+the nodes that came into view, so that reading isn't held up. The data of the rest of the tree is calculated
+once every game is read, with the subtree being looked at by the user calculated first.
+
+A snapshot is swapped in while holding the builder's lock, along with the data of the nodes in view, and the
+data of every other node is cleared then, so all of the data in the tree is from the same games. The data of
+other nodes is only attached to them once fully calculated, while holding the lock.
+
+If the loader samples games, the tree is first built with approximate data from the sample. Every game is
+then read, and the exact data of all nodes replaces the approximate data at once.
+"""
+from __future__ import annotations
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+from chess_data import ChessData
+from datasets import DATASETS, DatasetLoader
+from game_bitmap import GameIndex
+from game_reader import HEADERS, read_games, read_games_sample
+from move_tree import MoveTree
+
+# While games are read, a new snapshot of the index is published once at least this many seconds passed since
+# the last one, and at least as many games were read since as it holds
+PUBLISH_EVERY = 2.0
+
+
+class BuildCancelled(Exception):
+    """Raised inside the build when the builder was stopped."""
+
+
+class TreeBuilder:
+    """
+    Builds the MoveTree of a dataset in a background thread.
+
+    Commands reading the tree while it is built should hold lock, so that no data is attached
+    to the tree while they run.
+    """
+    tree: MoveTree
+    tc: int
+    index: Optional[GameIndex]
+    lock: threading.RLock
+    games_parsed: int
+    nodes_built: int
+    total_nodes: int
+    error: Optional[str]
+    # Private Instance Attributes:
+    # - _loader: The loader holding the openings and the parsed games cache
+    # - _files: The .pgn files of the dataset being built
+    # - _pending: The nodes waiting for their data, in breadth first order
+    # - _priority: The nodes to calculate the data of before any others, in breadth first order, along with
+    #              whether their next moves should be prioritized too
+    # - _focus: The node prioritized last, whose data is calculated first from each snapshot of the index
+    # - _unindexed: The games read since the last snapshot of the index
+    # - _published: The time (from time.monotonic) the last snapshot was published at, or reading started at
+    # - _complete: Whether the index holds every game of the dataset, rather than a sample or the games read so far
+    # - _thread: The thread doing the build
+    # - _stopped: Whether the build was asked to stop
+    # - _building_all: Whether every game was read, and the data of the whole tree is being built at once
+    #                  (in parallel shards, or to replace the approximate data)
+    _loader: DatasetLoader
+    _files: list[str]
+    _pending: deque[MoveTree]
+    _priority: deque[tuple[MoveTree, bool]]
+    _focus: MoveTree
+    _unindexed: dict[str, list]
+    _published: float
+    _complete: bool
+    _thread: threading.Thread
+    _stopped: bool
+    _building_all: bool
+
+    def __init__(self, loader: DatasetLoader, name: str) -> None:
+        """
+        Insert the openings of the loader into a new tree, to be filled in with the data of the dataset
+        once started.
+
+        Preconditions:
+        - name in DATASETS
+        """
+        self._loader = loader
+        self._files, self.tc = DATASETS[name]
+        self.index = None
+        self.lock = threading.RLock()
+        self.games_parsed = 0
+        self.nodes_built = 0
+        self.error = None
+        self._stopped = False
+        self._building_all = False
+        self._complete = False
+        self._unindexed = {header: [] for header in HEADERS}
+        self._published = 0.0
+
+        self.tree = MoveTree("")
+        for move_sequence in loader.openings_database:
+            self.tree.insert_sequence(list(move_sequence), None, loader.openings_database)
+        self.total_nodes = self.tree.subtree_size()
+        self._pending = deque([self.tree])
+        self._priority = deque()
+        self._focus = self.tree
+        self._thread = threading.Thread(target=self._build, daemon=True)
+
+    def start(self) -> None:
+        """Start building the tree in the background."""
+        self._thread.start()
+
+    def wait(self) -> None:
+        """Wait until the build finished, or stopped if it was asked to."""
+        self._thread.join()
+
+    def stop(self) -> None:
+        """Ask the build to stop as soon as possible. Does not wait for it to stop."""
+        self._stopped = True
+
+    def is_done(self) -> bool:
+        """Return whether every node has its exact data, from every game."""
+        return self._complete and self.nodes_built == self.total_nodes
+
+    def prioritize(self, node: MoveTree) -> None:
+        """
+        Calculate the data of the node, its previous moves and its subtree before any other nodes.
+        """
+        with self.lock:
+            self._focus = node
+            self._priority = _priority_order(node)
+
+    def progress(self) -> str:
+        """Return a description of how far along the build is."""
+        if self.error:
+            return f"Build failed: {self.error}"
+        elif self.is_done():
+            return f"The tree is fully built from {self.index.size} games"
+        elif self._building_all:
+            shard_depth = self._loader.shard_depth
+            shards = f" in parallel, split by the first {shard_depth} moves" if shard_depth else ""
+            shown = f"Showing {self._shown()}. " if self.index else ""
+            return f"{shown}Building the tree from all {self.games_parsed} games{shards}"
+        elif self.index is None:
+            sample = "a sample of " if self._loader.sample_rate else ""
+            return f"Reading {sample}games: {self.games_parsed} games parsed{self._malformed()}"
+
+        built = f"{self.nodes_built}/{self.total_nodes} nodes built"
+        if self._complete or (self.index.population is not None and self.nodes_built < self.total_nodes):
+            return f"Building tree: {built} from {self.index.size} games"
+        elif self.index.population is not None:
+            return (f"Showing {self._shown()}. "
+                    f"Reading every game for the exact stats: {self.games_parsed} games parsed{self._malformed()}")
+        return (f"Reading games: {self.games_parsed} games parsed{self._malformed()}. Showing {self._shown()} "
+                f"for the positions looked at, the rest of the tree is built once every game is read")
+
+    def partial_note(self) -> Optional[str]:
+        """
+        Return a note of which games the stats in the tree are from, if not from every game of the dataset yet.
+        Return None if they are, or if there are no stats yet.
+        """
+        if self.index is None or self._complete:
+            return None
+        return f"Note: showing {self._shown()}, the tree is still being built. Type 'progress' for more."
+
+    def _shown(self) -> str:
+        """Return a description of the games the stats shown are from."""
+        if self.index.population is not None:
+            return f"approximate stats from a sample of {self.index.size} games"
+        return f"stats from the first {self.index.size} games read"
+
+    def _malformed(self) -> str:
+        """Return a note of the number of malformed games skipped in the files read so far, if any."""
+        malformed = sum(self._loader.cache.malformed.get(filename, 0) for filename in self._files)
+        return f" ({malformed} malformed games skipped)" if malformed else ""
+
+    def _build(self) -> None:
+        """
+        Read and index the games, then calculate the data of every node.
+        If the build fails (or is stopped), it ends with the reason in error, which progress shows.
+        """
+        try:
+            self._read_and_build()
+        except BuildCancelled:
+            self.error = "Stopped"
+        except OSError as error:
+            self.error = str(error)
+        except Exception as error:  # pylint: disable=broad-exception-caught
+            # Kept for progress, instead of the thread printing the traceback over the prompt
+            self.error = f"{type(error).__name__}: {error}"
+
+    def _read_and_build(self) -> None:
+        """Read and index the games, then calculate the data of every node."""
+        if self._loader.sample_rate:
+            sample, population = read_games_sample(self._files, self._loader.sample_rate, progress=self._count_games,
+                                                   cache=self._loader.cache)
+            index = GameIndex(sample, self._loader.max_moves)
+            index.population = population
+            self._fill_in(index)
+            self.games_parsed = 0
+            games = read_games(self._files, self._loader.cache, self._count_games)
+        else:
+            # The approximate data of a sample is better than that of the first games read, so those are only
+            # published when not sampling
+            self._published = time.monotonic()
+            games = read_games(self._files, self._loader.cache, self._count_games, self._add_games)
+
+        if self._loader.shard_depth or self._loader.sample_rate:
+            self._building_all = True
+            self._copy_data(*self._loader.build(games))
+        else:
+            self._fill_in(self._index_read_games(), complete=True)
+
+    def _add_games(self, games: dict[str, list]) -> None:
+        """
+        Add the games read to those waiting to be indexed, and publish a new snapshot of the index (calculating
+        the data of the nodes in view from it) if one is due. See PUBLISH_EVERY. Otherwise, calculate the data
+        of the nodes that came into view since the last batch from the last snapshot.
+        """
+        for header, column in games.items():
+            self._unindexed[header].extend(column)
+        indexed = self.index.size if self.index else 0
+        due = time.monotonic() - self._published >= PUBLISH_EVERY and len(self._unindexed['moves']) >= indexed
+        if self._stopped:
+            return
+        elif due:
+            self._swap_in(self._index_read_games(), False)
+            self._published = time.monotonic()
+        elif self.index:
+            self._fill_view()
+
+    def _index_read_games(self) -> GameIndex:
+        """
+        Return the index of every game read so far: the last snapshot of the index, with the games read since
+        indexed and merged into it (or the last snapshot itself, if no games were read since).
+        """
+        start = self.index.size if self.index else 0
+        unindexed, self._unindexed = self._unindexed, {header: [] for header in HEADERS}
+        if not start:
+            return GameIndex(unindexed, self._loader.max_moves)
+        elif not unindexed['moves']:
+            return self.index
+        index = GameIndex(unindexed, self._loader.max_moves, list(range(start, start + len(unindexed['moves']))))
+        return GameIndex.merge([self.index, index])
+
+    def _fill_in(self, index: GameIndex, complete: bool = False) -> None:
+        """
+        Swap in the index (see _swap_in), then calculate the data of every node without any, one node at a time.
+        complete is whether the index holds every game of the dataset.
+        """
+        if index is self.index:  # the games of the last snapshot were every game
+            with self.lock:
+                self._complete = complete
+        else:
+            self._swap_in(index, complete)
+
+        node = self._next_node()
+        while node and not self._stopped:
+            data = self._calculate(node, node.parent.data if node.parent else None, self.index)
+            with self.lock:
+                node.data = data
+                self.nodes_built += 1
+            node = self._next_node()
+
+    def _swap_in(self, index: GameIndex, complete: bool) -> None:
+        """
+        Make the index the one the data of the tree is calculated from. The data of the nodes in view (the
+        prioritized node, its previous moves and its next moves) is calculated from the index first, and replaces
+        the data of the tree at once, so every node with data has data from the same games. The other nodes get
+        their data from the index afterwards.
+        """
+        data = {}
+        for node in self._view():
+            data[node] = self._calculate(node, data.get(node.parent), index)
+
+        with self.lock:
+            pending = [self.tree]
+            while pending:
+                node = pending.pop()
+                node.data = data.get(node)
+                pending.extend(node.next_moves)
+            self.index = index
+            self._complete = complete
+            self.nodes_built = len(data)
+            self._pending = deque([self.tree])
+            self._priority = _priority_order(self._focus)
+
+    def _fill_view(self) -> None:
+        """
+        Calculate the data of the nodes in view without any from the current index, one node at a time.
+        """
+        for node in self._view():
+            if node.data is None:
+                data = self._calculate(node, node.parent.data if node.parent else None, self.index)
+                with self.lock:
+                    node.data = data
+                    self.nodes_built += 1
+
+    def _view(self) -> list[MoveTree]:
+        """
+        Return the nodes in view: the prioritized node, its previous moves (from the root) and its next moves.
+        """
+        focus = self._focus
+        return [ancestor for ancestor, _ in _priority_order(focus)] + focus.next_moves
+
+    def _calculate(self, node: MoveTree, parent_data: Optional[ChessData], index: GameIndex) -> ChessData:
+        """
+        Return the data of the node, calculated from the index.
+        parent_data is the data of the node's previous move from the same index, if it was calculated already.
+        """
+        path = node.get_path()
+        return ChessData(path, index, self._loader.openings_database.get(tuple(path)),
+                         parent_data.games if parent_data else None)
+
+    def _copy_data(self, tree: MoveTree, index: GameIndex) -> None:
+        """
+        Attach the data of every node of the given tree (of the same openings, built all at once) to
+        the nodes of this tree, replacing any data they had. All of the data is replaced at once.
+        """
+        if self._stopped:
+            return
+        with self.lock:
+            pending = [(self.tree, tree)]
+            while pending:
+                node, built = pending.pop()
+                node.data = built.data
+                pending.extend(zip(node.next_moves, built.next_moves))
+            self.index = index
+            self._complete = True
+            self.nodes_built = self.total_nodes
+
+    def _next_node(self) -> Optional[MoveTree]:
+        """
+        Return the next node that has no data, prioritized nodes first. Return None if every node has data.
+        """
+        with self.lock:
+            while self._priority:
+                node, expand = self._priority.popleft()
+                if expand:
+                    self._priority.extend((next_move, True) for next_move in node.next_moves)
+                if node.data is None:
+                    return node
+            while self._pending:
+                node = self._pending.popleft()
+                self._pending.extend(node.next_moves)
+                if node.data is None:
+                    return node
+        return None
+
+    def _count_games(self, count: int) -> None:
+        """Add to the number of games parsed, stopping the build if asked to."""
+        if self._stopped:
+            raise BuildCancelled
+        self.games_parsed += count
+
+
+def _priority_order(node: MoveTree) -> deque[tuple[MoveTree, bool]]:
+    """
+    Return the order to calculate the data of the node, its previous moves and its subtree in, along with
+    whether the next moves of each should be prioritized too (see TreeBuilder._priority).
+    """
+    ancestors = []
+    current = node.parent
+    while current:
+        ancestors.append(current)
+        current = current.parent
+    ancestors.reverse()
+    return deque([(ancestor, False) for ancestor in ancestors] + [(node, True)])
+
+
+if __name__ == '__main__':
+    pass
+    # import doctest
+    # doctest.testmod(verbose=True)
+    # import python_ta
+
+    # python_ta.check_all(config={
+    #     'max-line-length': 120,
+    #     'disable': ['E1136', 'W0221'],
+    #     'extra-imports': ['threading', 'time', 'collections', 'Optional', 'chess_data', 'datasets', 'game_bitmap',
+    #                       'game_reader', 'move_tree'],
+    #     'max-nested-blocks': 4
+    # })
@@ -0,0 +1,291 @@
+"""
+Exporting a MoveTree as shards of JSON, which can be loaded lazily.
+
+The tree is split into shards by subtree. A shard holds the next moves of one node, and their own next moves
+down to plies_per_shard moves in all; the next moves of the deepest of them are in shards of their own. The
+shard at the top holds the root, and its next moves down to plies_per_shard - 1 moves, so it has as many levels
+of the tree as the others (with the default of 2 plies per shard, the root and every first move).
+
+A shard is named by the SHA-256 hash of its contents, so shards never change once written and can be cached
+forever, and subtrees that are the same are only stored once. A small manifest (manifest.json) names the shard
+at the top, and holds what is common to the whole tree.
+
+Each node in a shard is an object like
+    {"move": "e4", "name": "King's Pawn Game", "counts": {"60": [plays, prev_plays, white, black, draw]},
+     "next": [...nodes...]}
+where "next" is replaced by "shard" (the hash of the shard holding the next moves) at the bottom of a shard.
+Counts are in the order of compact_tree.COUNTERS, and only given for time controls with games.
+
+load_exported returns a tree that can be used like a MoveTree (by the Traverser, for example), which only
+fetches the shards of the positions that are visited.
+"""
+from __future__ import annotations
+import hashlib
+import json
+import os
+from typing import Any, Callable, Optional
+
+from compact_tree import COUNTERS, CountsData, node_counts
+from move_tree import MoveTree
+
+MANIFEST = "manifest.json"
+FORMAT_VERSION = 1
+
+
+def export_tree(tree: MoveTree, directory: str, plies_per_shard: int = 2) -> dict[str, Any]:
+    """
+    Write the tree to the directory as a manifest and shards, returning the manifest.
+    Shards already in the directory (like from a previous export) are reused.
+
+    Loading the export gives back the same tree:
+    >>> import tempfile
+    >>> from game_bitmap import GameIndex
+    >>> from move_tree import build_tree
+    >>> games = GameIndex({'moves': [['e4', 'e5'], ['d4', 'd5'], ['e4', 'c5'], ['e4', 'e5'], ['d4']],
+    ...                    'time_control': [60, 180, 60, 180, 60],
+    ...                    'winner': ['white', 'draw', 'black', 'white', 'black']})
+    >>> tree = build_tree(games, {('e4', 'e5'): "Open Game", ('d4',): "Queen's Pawn Game",
+    ...                           ('e4', 'c5'): "Sicilian Defense", ('d4', 'd5'): "Closed Game"})
+    >>> for plies_per_shard in [1, 2]:
+    ...     directory = tempfile.mkdtemp()
+    ...     manifest = export_tree(tree, directory, plies_per_shard)
+    ...     print(manifest['shards'], load_exported(directory).same_as(tree))
+    4 True
+    3 True
+
+    Preconditions:
+    - every node of the tree has data
+    - plies_per_shard >= 1
+    """
+    time_controls = list(tree.data.plays)
+    shards = set()
+    root = _write_shard([tree], directory, time_controls, plies_per_shard, shards)
+
+    approximate = tree.data.is_approximate()
+    manifest = {
+        'version': FORMAT_VERSION,
+        'root': root,
+        'time_controls': time_controls,
+        'counters': COUNTERS,
+        # The number of games of each time control, and how many of them were sampled if the data is approximate
+        'population': {str(tc): round(tree.data.get_plays(tc)) for tc in time_controls} if approximate else None,
+        'sampled': {str(tc): tree.data.plays[tc] for tc in time_controls},
+        'nodes': tree.subtree_size(),
+        'shards': len(shards)
+    }
+    with open(os.path.join(directory, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def _write_shard(nodes: list[MoveTree], directory: str, time_controls: list[int], plies_per_shard: int,
+                 shards: set[str]) -> str:
+    """
+    Write the shard holding the nodes (and the shards below it), unless it was already written.
+    Return its hash, after adding it (and the hashes of the shards below it) to shards.
+    """
+    stored = [_stored_node(node, directory, time_controls, plies_per_shard - 1, plies_per_shard, shards)
+              for node in nodes]
+    content = json.dumps(stored, separators=(',', ':'), sort_keys=True).encode('utf-8')
+    digest = hashlib.sha256(content).hexdigest()
+    path = os.path.join(directory, *_shard_path(digest).split('/'))
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(content)
+    shards.add(digest)
+    return digest
+
+
+def _stored_node(node: MoveTree, directory: str, time_controls: list[int], plies_left: int, plies_per_shard: int,
+                 shards: set[str]) -> dict[str, Any]:
+    """Return the node as stored in a shard, with its next moves down to plies_left moves deeper."""
+    counts = {str(tc): node_counts(node.data, tc) for tc in time_controls}
+    stored = {'move': node.move, 'counts': {tc: tc_counts for tc, tc_counts in counts.items() if any(tc_counts)}}
+    if node.data.name:
+        stored['name'] = node.data.name
+
+    if node.next_moves and plies_left == 0:
+        stored['shard'] = _write_shard(node.next_moves, directory, time_controls, plies_per_shard, shards)
+    elif node.next_moves:
+        stored['next'] = [_stored_node(next_move, directory, time_controls, plies_left - 1, plies_per_shard, shards)
+                          for next_move in node.next_moves]
+    return stored
+
+
+class ShardStore:
+    """
+    Fetches the shards of an exported tree, checking each against its hash, and keeps those fetched.
+    """
+    manifest: dict[str, Any]
+    # Private Instance Attributes:
+    # - _fetch: Returns the contents of a file of the export, given its path relative to the exported directory
+    # - _shards: The shards fetched so far, by hash
+    _fetch: Callable[[str], bytes]
+    _shards: dict[str, list[dict[str, Any]]]
+
+    def __init__(self, fetch: Callable[[str], bytes]) -> None:
+        """
+        Read the manifest with the given fetch function. fetch returns the contents of a file of the export
+        given its path relative to the exported directory, with '/' between folders (like 'manifest.json' or
+        'shards/ab/ab12....json'), so it can read the files from disk or download them.
+
+        Raise a ValueError if the export is of an unsupported format.
+        """
+        self._fetch = fetch
+        self._shards = {}
+        self.manifest = json.loads(fetch(MANIFEST))
+        if self.manifest.get('version') != FORMAT_VERSION:
+            raise ValueError(f"Unsupported export format version {self.manifest.get('version')}")
+
+    def shard(self, digest: str) -> list[dict[str, Any]]:
+        """
+        Return the nodes of the shard with the given hash, fetching it if it was not fetched before.
+
+        Raise a ValueError if the shard fetched does not match its hash.
+        """
+        if digest not in self._shards:
+            content = self._fetch(_shard_path(digest))
+            if hashlib.sha256(content).hexdigest() != digest:
+                raise ValueError(f"Shard {digest} does not match its hash")
+            self._shards[digest] = json.loads(content)
+        return self._shards[digest]
+
+    def shards_fetched(self) -> int:
+        """Return the number of shards fetched so far."""
+        return len(self._shards)
+
+
+class ExportedTree(MoveTree):
+    """
+    A node of an exported tree, which can be used like a MoveTree but cannot be changed.
+    The shard holding the next moves is only fetched when they are first needed.
+    """
+    # Private Instance Attributes:
+    # - _store: Where the shards of the tree are fetched from
+    # - _stored: The node as stored in its shard
+    # - _parent: The parent of this node, or None if it is the root
+    # - _next_moves: The next moves, or None if they have not been needed yet
+    _store: ShardStore
+    _stored: dict[str, Any]
+    _parent: Optional[ExportedTree]
+    _next_moves: Optional[list[ExportedTree]]
+
+    def __init__(self, store: ShardStore, stored: dict[str, Any],  # pylint: disable=super-init-not-called
+                 parent: Optional[ExportedTree] = None) -> None:
+        self._store = store
+        self._stored = stored
+        self._parent = parent
+        self._next_moves = None
+
+    @property
+    def move(self) -> str:
+        return self._stored['move']
+
+    @property
+    def parent(self) -> Optional[ExportedTree]:
+        return self._parent
+
+    @property
+    def next_moves(self) -> list[ExportedTree]:
+        if self._next_moves is None:
+            if 'shard' in self._stored:
+                stored_moves = self._store.shard(self._stored['shard'])
+            else:
+                stored_moves = self._stored.get('next', [])
+            self._next_moves = [ExportedTree(self._store, stored, self) for stored in stored_moves]
+        return self._next_moves
+
+    @property
+    def data(self) -> ExportedData:
+        return ExportedData(self)
+
+    def insert_sequence(self, move_sequence: list[str], games_database: Optional[Any] = None,
+                        openings_database: Optional[dict[tuple[str, ...], str]] = None) -> None:
+        raise TypeError("An exported tree cannot be changed")
+
+
+class ExportedData(CountsData):
+    """
+    The statistics of a node of an exported tree, which can be used like a ChessData.
+
+    The games are not exported, so the statistics cannot be filtered, and there are no trends.
+    """
+    # Private Instance Attributes:
+    # - _tree: The node this is the data of
+    _tree: ExportedTree
+
+    def __init__(self, tree: ExportedTree) -> None:  # pylint: disable=super-init-not-called
+        self._tree = tree
+
+    @property
+    def name(self) -> Optional[str]:
+        return self._tree._stored.get('name')
+
+    @property
+    def move_sequence(self) -> list[str]:
+        return self._tree.get_path()
+
+    @property
+    def trends(self) -> dict:
+        return {}
+
+    def is_approximate(self) -> bool:
+        return self._tree._store.manifest['population'] is not None
+
+    def get_plays(self, tc: Optional[int]) -> float:
+        plays = self._count(tc, 'plays')
+        if not self.is_approximate():
+            return plays
+        manifest = self._tree._store.manifest
+        sampled = manifest['sampled'].get(str(tc), 0)
+        return plays * manifest['population'].get(str(tc), 0) / sampled if sampled else 0.0
+
+    def _time_controls(self) -> list[int]:
+        return self._tree._store.manifest['time_controls']
+
+    def _count(self, tc: Optional[int], counter: str) -> int:
+        counts = self._tree._stored['counts'].get(str(tc))
+        return counts[COUNTERS.index(counter)] if counts else 0
+
+
+def load_exported(directory: str) -> ExportedTree:
+    """Return the root of the tree exported to the directory. Shards are read from disk when first needed."""
+    return open_exported(lambda path: _read_file(os.path.join(directory, *path.split('/'))))
+
+
+def open_exported(fetch: Callable[[str], bytes]) -> ExportedTree:
+    """Return the root of an exported tree, whose files are fetched with fetch (see ShardStore)."""
+    store = ShardStore(fetch)
+    return ExportedTree(store, store.shard(store.manifest['root'])[0])
+
+
+def _shard_path(digest: str) -> str:
+    """
+    Return the path of the shard with the given hash, relative to the exported directory.
+    Shards are put in folders by the first two letters of their hash, to keep folders small.
+
+    >>> _shard_path('ab12')
+    'shards/ab/ab12.json'
+    """
+    return f"shards/{digest[:2]}/{digest}.json"
+
+
+def _read_file(path: str) -> bytes:
+    """Return the contents of the file."""
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+if __name__ == '__main__':
+    pass
+    # import doctest
+    # doctest.testmod(verbose=True)
+    # import python_ta
+
+    # python_ta.check_all(config={
+    #     'max-line-length': 120,
+    #     'disable': ['E1136', 'W0221'],
+    #     'extra-imports': ['hashlib', 'json', 'os', 'Any', 'Callable', 'Optional', 'compact_tree', 'move_tree'],
+    #     'max-nested-blocks': 4
+    # })
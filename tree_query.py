@@ -0,0 +1,200 @@
+"""
+Querying every position of a MoveTree at once.
+
+The statistics of every node are flattened into NumPy arrays, with a row per node and a column per time
+control. A query like "black > 55% and plays >= 200 and depth <= 6" is then answered by a few vectorized
+comparisons over the whole tree, instead of visiting each node.
+
+NumPy is only imported once a tree is flattened, to keep startup fast.
+"""
+from __future__ import annotations
+import operator
+import re
+from typing import TYPE_CHECKING, Callable, Optional
+
+from chess_data import ChessData
+from game_bitmap import parse_condition
+from move_tree import MoveTree
+
+if TYPE_CHECKING:
+    import numpy as np
+
+# The statistics that can be queried
+QUERY_FIELDS = ['plays', 'playrate', 'white', 'black', 'draw', 'white_score', 'black_score', 'depth']
+# The statistics that are rates. They can be given as percentages ('55%') or as proportions ('0.55'), so a rate
+# above 1 without a '%' (like '55', most likely meant as a percentage) is rejected rather than matching nothing
+RATE_FIELDS = ['playrate', 'white', 'black', 'draw', 'white_score', 'black_score']
+# Conditions of a query are separated by "and" or commas
+_SEPARATOR = re.compile(r'\s+and\s+|\s*,\s*', re.IGNORECASE)
+# Symbols accepted in place of the operators of game_bitmap.OPERATORS
+_SYMBOLS = {'≥': '>=', '≤': '<=', '≠': '!='}
+_OPERATIONS = {'=': operator.eq, '!=': operator.ne, '>=': operator.ge, '<=': operator.le, '>': operator.gt,
+               '<': operator.lt}
+
+# A condition on a statistic, as (field, op, value)
+Condition = tuple[str, str, float]
+
+
+class NodeArrays:
+    """
+    The statistics of every node of a MoveTree (with data), flattened into arrays with a row per node.
+    Rows are in preorder, so a node comes before the nodes after it.
+
+    Depth is one value per node (the number of moves from the root of the tree); the other fields have a
+    column per time control. Plays are estimated for the whole dataset if the data is approximate.
+    The score of a side is its win rate plus half the draw rate, the points it scores per game.
+    """
+    time_controls: list[int]
+    # Private Instance Attributes:
+    # - _root: The node the tree was flattened from
+    # - _nodes: The node of each row
+    # - _fields: Maps each field in QUERY_FIELDS to its array
+    _root: MoveTree
+    _nodes: list[MoveTree]
+    _fields: dict[str, np.ndarray]
+
+    def __init__(self, tree: MoveTree, data_of: Optional[Callable[[MoveTree], Optional[ChessData]]] = None) -> None:
+        """
+        Flatten the statistics of the tree. If given, data_of returns the data to use for a node (like the
+        data restricted to some filtered games); otherwise the data of the node itself is used.
+        Nodes without data (like ones that are still being built) are left out.
+        """
+        import numpy as np  # only imported when needed, as it is slow to import
+
+        if data_of is None:
+            data_of = _own_data
+        self._root = tree
+        self._nodes = []
+        self.time_controls = []
+        rows = {field: [] for field in QUERY_FIELDS}
+        stack = [(tree, 0)]
+        while stack:
+            node, depth = stack.pop()
+            stack.extend((next_move, depth + 1) for next_move in reversed(node.next_moves))
+            data = data_of(node)
+            if data is None:
+                continue
+            if not self.time_controls:
+                self.time_controls = list(data.plays)
+
+            self._nodes.append(node)
+            rows['depth'].append(depth)
+            rows['plays'].append([data.get_plays(tc) for tc in self.time_controls])
+            rows['playrate'].append([data.get_playrate(tc) for tc in self.time_controls])
+            for winner in ['white', 'black', 'draw']:
+                rows[winner].append([data.get_winrate(winner, tc) for tc in self.time_controls])
+            draws = rows['draw'][-1]
+            for side in ['white', 'black']:
+                rows[side + '_score'].append([wins + draw / 2 for wins, draw in zip(rows[side][-1], draws)])
+
+        width = len(self.time_controls)
+        self._fields = {field: np.array(values, dtype=np.float64).reshape(len(self._nodes), width)
+                        for field, values in rows.items() if field != 'depth'}
+        self._fields['depth'] = np.array(rows['depth'], dtype=np.int32)
+
+    def __len__(self) -> int:
+        """Return the number of nodes flattened."""
+        return len(self._nodes)
+
+    def select(self, conditions: list[Condition], tc: int) -> list[MoveTree]:
+        """
+        Return the nodes satisfying every condition at the given timecontrol, most played first.
+        Return an empty list if there is no data for the timecontrol.
+
+        Preconditions:
+        - all(field in QUERY_FIELDS and op in _OPERATIONS for field, op, _ in conditions)
+        """
+        import numpy as np
+
+        if tc not in self.time_controls:
+            return []
+        column = self.time_controls.index(tc)
+        mask = np.ones(len(self._nodes), dtype=bool)
+        for field, op, value in conditions:
+            values = self._fields[field] if field == 'depth' else self._fields[field][:, column]
+            mask &= _OPERATIONS[op](values, value)
+
+        rows = np.flatnonzero(mask)
+        rows = rows[np.argsort(-self._fields['plays'][rows, column], kind='stable')]
+        return [self._nodes[row] for row in rows]
+
+    def path(self, node: MoveTree) -> list[str]:
+        """Return the moves from the root of the flattened tree to the node."""
+        return node.get_path()[len(self._root.get_path()):]
+
+
+def parse_query(query: str) -> Optional[tuple[list[Condition], Optional[int]]]:
+    """
+    Parse a query like "black > 55% and plays >= 200 and depth <= 6 and tc = 180" into its conditions,
+    and the timecontrol it asks for (None if not given). Return None if the query is not valid, like one
+    comparing a rate to a number above 1 without a '%'.
+
+    >>> parse_query("black > 55% and plays ≥ 200, depth<=6 and tc=180")
+    ([('black', '>', 0.55), ('plays', '>=', 200.0), ('depth', '<=', 6.0)], 180)
+    >>> parse_query("white_score >= 52% and depth = 4")
+    ([('white_score', '>=', 0.52), ('depth', '=', 4.0)], None)
+    >>> parse_query("plays > lots") is None
+    True
+    >>> parse_query("black > 55") is None
+    True
+    >>> parse_query("black > 0.55 and white_score < 1")
+    ([('black', '>', 0.55), ('white_score', '<', 1.0)], None)
+    """
+    for symbol, op in _SYMBOLS.items():
+        query = query.replace(symbol, op)
+
+    conditions, tc = [], None
+    for part in _SEPARATOR.split(query.strip()):
+        condition = parse_condition(part)
+        if condition is None:
+            return None
+        field, op, value = condition
+        try:
+            number = float(value.removesuffix('%'))
+        except ValueError:
+            return None
+
+        if field == 'tc' and op == '=':
+            tc = int(number)
+        elif field in RATE_FIELDS and number > 1 and not value.endswith('%'):
+            return None
+        elif field in RATE_FIELDS or (field in QUERY_FIELDS and not value.endswith('%')):
+            conditions.append((field, op, number / 100 if value.endswith('%') else number))
+        else:
+            return None
+    return conditions, tc
+
+
+def query_tree(tree: MoveTree, query: str, tc: int) -> list[list[str]]:
+    """
+    Return the paths (from the root of the tree) of the positions satisfying the query (see parse_query),
+    most played first. The timecontrol given is used if the query does not ask for one.
+
+    Raise a ValueError if the query is not valid.
+    """
+    parsed = parse_query(query)
+    if parsed is None:
+        raise ValueError(f"Invalid query {query!r}")
+    conditions, query_tc = parsed
+    arrays = NodeArrays(tree)
+    return [arrays.path(node) for node in arrays.select(conditions, query_tc or tc)]
+
+
+def _own_data(node: MoveTree) -> Optional[ChessData]:
+    """Return the data of the node itself."""
+    return node.data
+
+
+if __name__ == '__main__':
+    pass
+    # import doctest
+    # doctest.testmod(verbose=True)
+    # import python_ta
+
+    # python_ta.check_all(config={
+    #     'max-line-length': 120,
+    #     'disable': ['E1136', 'W0221'],
+    #     'extra-imports': ['numpy', 'operator', 're', 'Callable', 'Optional', 'chess_data', 'game_bitmap',
+    #                       'move_tree'],
+    #     'max-nested-blocks': 4
+    # })
@@ -0,0 +1,153 @@
+"""
+Time-bucketed counts of the games reaching a position, to see how its popularity and results change over time.
+
+Games are counted by the UTC day they were played on. Days are only grouped into weeks (starting on Monday)
+or months when a trend is asked for, and only the days that games were actually played on are stored, so
+positions that are rarely played cost almost nothing.
+"""
+from __future__ import annotations
+import datetime
+from array import array
+from typing import Any
+
+SECONDS_PER_DAY = 24 * 60 * 60
+BUCKETS = ['day', 'week', 'month']
+# The counts kept for each day, in order
+COUNTS = ['plays', 'white', 'black', 'draw']
+# The day of games whose date is not known
+NO_DAY = -1
+# 1970-01-01 (day 0) was a Thursday, so weeks starting on Monday start 3 days later
+_WEEK_SHIFT = 3
+_EPOCH = datetime.date(1970, 1, 1)
+
+
+class TrendCounters:
+    """
+    The number of games reaching a position, and the number won by white, won by black and drawn,
+    on each day that games reaching it were played.
+    """
+    # Private Instance Attributes:
+    # - _days: The days (counted from 1970-01-01) with at least one game, in increasing order
+    # - _counts: For each day in _days, its counts (in the order of COUNTS), one day after the other
+    _days: array
+    _counts: array
+
+    def __init__(self, plays: dict[int, int], results: dict[str, dict[int, int]]) -> None:
+        """
+        Store the given counts, where plays maps a day to its number of games, and results maps
+        'white', 'black' and 'draw' to the number of games with that result on each day.
+
+        >>> counters = TrendCounters({3: 2, 1: 1}, {'white': {3: 1}, 'black': {}, 'draw': {1: 1}})
+        >>> counters.bucketed('day')
+        {1: [1, 0, 0, 1], 3: [2, 1, 0, 0]}
+        """
+        self._days = array('i', sorted(plays))
+        self._counts = array('I')
+        for day in self._days:
+            self._counts.extend([plays[day]] + [results[result].get(day, 0) for result in COUNTS[1:]])
+
+    def __bool__(self) -> bool:
+        return bool(self._days)
+
+    def bucketed(self, bucket: str) -> dict[int, list[int]]:
+        """
+        Return the counts grouped by bucket (see bucket_of), in increasing order of bucket. Each bucket maps
+        to its counts, in the order of COUNTS.
+
+        Preconditions:
+        - bucket in BUCKETS
+        """
+        buckets = {}
+        for i, day in enumerate(self._days):
+            counts = buckets.setdefault(bucket_of(day, bucket), [0] * len(COUNTS))
+            for j in range(len(COUNTS)):
+                counts[j] += self._counts[len(COUNTS) * i + j]
+        return buckets
+
+
+def day_number(timestamp: Any) -> int:
+    """
+    Return the day the timestamp (in seconds since 1970-01-01 UTC) is on, counting from 1970-01-01.
+    Return NO_DAY if there is no timestamp (None, or NaN in a dataframe).
+
+    >>> day_number(86400 * 3 + 5)
+    3
+    >>> day_number(None)
+    -1
+    """
+    if timestamp is None or timestamp != timestamp:
+        return NO_DAY
+    return int(timestamp) // SECONDS_PER_DAY
+
+
+def bucket_of(day: int, bucket: str) -> int:
+    """
+    Return the bucket the day falls in. Consecutive days, weeks and months have consecutive buckets.
+
+    >>> bucket_of(20172, 'day')
+    20172
+    >>> bucket_label(bucket_of(20172, 'week'), 'week')
+    'week of 2025-03-24'
+    >>> bucket_label(bucket_of(20172, 'month'), 'month')
+    '2025-03'
+
+    Preconditions:
+    - bucket in BUCKETS
+    """
+    if bucket == 'day':
+        return day
+    elif bucket == 'week':
+        return (day + _WEEK_SHIFT) // 7
+    date = _EPOCH + datetime.timedelta(days=day)
+    return date.year * 12 + date.month - 1
+
+
+def bucket_label(key: int, bucket: str) -> str:
+    """
+    Return a readable name of the bucket.
+
+    >>> bucket_label(20172, 'day')
+    '2025-03-25'
+
+    Preconditions:
+    - bucket in BUCKETS
+    """
+    if bucket == 'day':
+        return (_EPOCH + datetime.timedelta(days=key)).isoformat()
+    elif bucket == 'week':
+        return f"week of {(_EPOCH + datetime.timedelta(days=key * 7 - _WEEK_SHIFT)).isoformat()}"
+    return f"{key // 12}-{key % 12 + 1:02}"
+
+
+def rolling_rates(successes: dict[int, int], samples: dict[int, int],
+                  window: int) -> list[tuple[int, int, float, float]]:
+    """
+    Return, for each bucket with samples (in increasing order), the bucket, its number of samples,
+    the proportion of successes in it, and the proportion of successes over the window of the last
+    window buckets up to and including it.
+
+    >>> rolling_rates({1: 1, 2: 3}, {1: 2, 2: 6, 4: 2}, 2)
+    [(1, 2, 0.5, 0.5), (2, 6, 0.5, 0.5), (4, 2, 0.0, 0.0)]
+    """
+    rates = []
+    for key in sorted(samples):
+        if samples[key] == 0:
+            continue
+        window_successes = sum(successes.get(k, 0) for k in range(key - window + 1, key + 1))
+        window_samples = sum(samples.get(k, 0) for k in range(key - window + 1, key + 1))
+        rates.append((key, samples[key], successes.get(key, 0) / samples[key], window_successes / window_samples))
+    return rates
+
+
+if __name__ == '__main__':
+    pass
+    # import doctest
+    # doctest.testmod(verbose=True)
+    # import python_ta
+
+    # python_ta.check_all(config={
+    #     'max-line-length': 120,
+    #     'disable': ['E1136', 'W0221'],
+    #     'extra-imports': ['datetime', 'array', 'Any'],
+    #     'max-nested-blocks': 4
+    # })